@@ -0,0 +1,309 @@
+import numpy as np
+import json
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import List, Union
+import torch
+import torch.nn as nn
+import torch.multiprocessing as tmp
+from torch.utils.tensorboard import SummaryWriter
+
+from traffic_envs import Environment_Traffic_Lights
+from states import State
+from rewards import Reward
+from memory import ReplayBuffer, SharedReplayBuffer
+from models import DQN_3h
+from trainer import DQNTrainer
+from policy import GreedyPolicy
+from experiment import make_model_dir, check_state_shape
+from vector_env import worker_route_file
+
+
+def _actor(actor_id: int, shared_net: nn.Module, weights_lock, transitions, stop, drained, env_kwargs: dict,
+           seed: Union[None, int], chunk_size: int, max_timesteps: int, max_eps: float, min_eps: float,
+           eps_decay: float, num_actions: int, replay_buffer: Union[None, SharedReplayBuffer] = None):
+    """
+    runs episodes with an epsilon-greedy policy over the shared (periodically synced) Q-network,
+    transitions are appended straight into a shared replay buffer when given, 
+    otherwise sent in chunks of tensors, which the queue passes through shared memory \\
+    on stop the last partial chunk is sent too, the actor then stays alive until the learner has drained
+    the queue (tensors sent by an exited process can not be received)
+    """
+    torch.set_num_threads(1)
+    np.random.seed(seed)
+    env = Environment_Traffic_Lights(**env_kwargs)
+    if actor_id == 0:
+        transitions.put(('hiperparams', env.hiperparams()))
+    policy = GreedyPolicy(shared_net)
+
+    chunk, k = None, 0
+    episode = 0
+    try:
+        while not stop.is_set():
+            epsilon = max(max_eps - episode*eps_decay, min_eps)
+            s_t = np.array(env.reset(), dtype=np.float32)
+            if chunk is None:
+                chunk = (np.zeros((chunk_size, *s_t.shape), dtype=np.float32), np.zeros(chunk_size, dtype=np.int64),
+                         np.zeros(chunk_size, dtype=np.float32), np.zeros((chunk_size, *s_t.shape), dtype=np.float32),
+                         np.zeros(chunk_size, dtype=bool))
+
+            episode_reward = 0.
+            for t in range(max_timesteps):
+                if stop.is_set():
+                    break
+                if np.random.rand() <= epsilon:
+                    action = np.random.choice(num_actions)
+                else:
+                    with weights_lock:
+                        action = policy.act(s_t)
+
+                s_t1, r_t, done, _ = env.step(action)
+                s_t1 = np.array(s_t1, dtype=np.float32)
+                if replay_buffer is not None:
+                    replay_buffer.append((s_t, action, r_t, s_t1, done))
+                else:
+                    for array, value in zip(chunk, (s_t, action, r_t, s_t1, done)):
+                        array[k] = value
+                    k += 1
+                    if k == chunk_size:
+                        transitions.put(('transitions', tuple(torch.from_numpy(array.copy()) for array in chunk)))
+                        k = 0
+
+                episode_reward += r_t
+                s_t = np.array(env.reset(), dtype=np.float32) if done else s_t1
+            else:
+                transitions.put(('episode', actor_id, episode_reward / max_timesteps, epsilon))
+                episode += 1
+        if k > 0:
+            # the partially filled chunk is not lost on stop
+            transitions.put(('transitions', tuple(torch.from_numpy(array[:k].copy()) for array in chunk)))
+    finally:
+        env.close()
+        if replay_buffer is not None:
+            replay_buffer.close()
+        transitions.put(('done', actor_id))
+        drained.wait(timeout=60)
+
+
+def run_actor_learner(state_class: State, reward_class: Reward, num_actors: int = 2, num_updates: int = 100000,
+                      seed: Union[None, int] = None, double: bool = True,
+                      # env parameters
+                      max_steps: int = 10000, route_car_freq: Union[None, List[float]] = None,
+                      sumo_cfg_file: str = 'intersection/my_net.sumocfg', route_file: str = 'intersection/my_net.rou.xml',
+                      yellow_duration: int = 4, green_duration: int = 4, backend: str = 'traci',
+                      # training parameters
+                      max_timesteps: int = 10000, min_buffer_length: int = 10000, max_buffer_length: int = 50000,
+                      batch_size: int = 32, gradient_steps: int = 1, hidden_layers: Union[None, List[int]] = None,
+                      optimizer_lr: float = 0.0008, target_net_update_freq: int = 250, weights_sync_freq: int = 50,
+                      checkpoint_freq: int = 10000, chunk_size: int = 32, gamma: float = 0.99, max_eps: float = 1,
+                      min_eps: float = 0.1, eps_decay: float = 0.01, state_shape: Union[None, int] = None,
+                      num_actions: int = 4, log_freq: int = 100, shared_buffer: bool = False, device: str = 'cpu') -> Path:
+    """
+    asynchronous actor-learner training of one DQN agent, returns its model directory \\
+    num_actors processes run their own SUMO and stream transitions into the replay buffer while
+    a learner thread performs num_updates updates, copying Qnet into the actors' network every weights_sync_freq updates \\
+    target_net_update_freq, checkpoint_freq and log_freq count updates, not environment steps \\
+    shared_buffer=True lets actors append into a SharedReplayBuffer themselves instead of sending chunks
+    """
+    if seed is not None:
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+
+    env_kwargs = {'state_class': state_class, 'reward_class': reward_class, 'max_steps': max_steps,
+                  'route_car_freq': route_car_freq, 'sumo_cfg_file': sumo_cfg_file, 'yellow_duration': yellow_duration,
+                  'green_duration': green_duration, 'backend': backend}
+    # the state size depends on the network's lanes, read from an environment of the first actor's settings
+    env = Environment_Traffic_Lights(**env_kwargs, route_file=worker_route_file(route_file, 0))
+    state_shape = check_state_shape(state_shape, env.state_size())
+    env.close()
+
+    MODEL_DIR = make_model_dir(Environment_Traffic_Lights.__name__)
+    START_TIME = int(MODEL_DIR.name)
+    learning_start = int(time.time())
+
+    Qnet = DQN_3h(input_size=state_shape, hidden_sizes=hidden_layers, output_size=num_actions).to(device)
+    Qtarget = None
+    if double:
+        Qtarget = DQN_3h(input_size=state_shape, hidden_sizes=hidden_layers, output_size=num_actions).to(device)
+        Qtarget.load_state_dict(Qnet.state_dict())
+    # cpu copy in shared memory the actors act with
+    shared_net = DQN_3h(input_size=state_shape, hidden_sizes=hidden_layers, output_size=num_actions)
+    shared_net.load_state_dict(Qnet.state_dict())
+    shared_net.share_memory()
+
+    optimizer = torch.optim.Adam(Qnet.parameters(), lr=optimizer_lr)
+    optimizer_hiperparams = {'name': optimizer.__class__.__name__, 'state_dict': optimizer.state_dict()}  # before any step
+    loss = nn.HuberLoss()
+
+    if shared_buffer:
+        # actors write into the buffer's shared segments, the learner needs no lock
+        buffer_lock = None
+        replay_buffer = SharedReplayBuffer(max_buffer_length, (state_shape,), device=device)
+    else:
+        buffer_lock = threading.Lock()
+        replay_buffer = ReplayBuffer(max_buffer_length, device=device)
+    trainer = DQNTrainer(Qnet, Qtarget, optimizer, replay_buffer, loss=loss, batch_size=batch_size, gamma=gamma,
+                         gradient_steps=gradient_steps, device=device, sample_lock=buffer_lock)
+
+    writer = SummaryWriter(log_dir=f'../runs/{Environment_Traffic_Lights.__name__}/run{START_TIME}_actor_learner', comment=f'{START_TIME}')
+
+    ctx = tmp.get_context('spawn')
+    weights_lock = ctx.Lock()
+    transitions = ctx.Queue(maxsize=num_actors * 64)
+    stop = ctx.Event()
+    drained = ctx.Event()
+
+    actors = []
+    for i in range(num_actors):
+        actor_seed = None if seed is None else seed + i + 1
+        actor = ctx.Process(target=_actor, daemon=True,
+                            args=(i, shared_net, weights_lock, transitions, stop, drained,
+                                  {**env_kwargs, 'route_file': worker_route_file(route_file, i)}, actor_seed,
+                                  chunk_size, max_timesteps, max_eps, min_eps, eps_decay, num_actions,
+                                  replay_buffer if shared_buffer else None))
+        actor.start()
+        actors.append(actor)
+
+    # -------------------------------------------------------------------------------------
+
+    losses = np.zeros(num_updates)
+    learner_done = threading.Event()
+    learner_errors = []  # re-raised in the main thread, a failed run is not saved
+
+    def learner():
+        try:
+            while len(replay_buffer) <= min_buffer_length and not learner_done.is_set():
+                time.sleep(0.01)
+            for update in range(num_updates):
+                if learner_done.is_set():
+                    break
+                losses[update] = trainer.update()
+                if (update+1) % target_net_update_freq == 0:
+                    trainer.sync_target()
+                if (update+1) % weights_sync_freq == 0:
+                    with weights_lock:
+                        shared_net.load_state_dict(Qnet.state_dict())
+                if (update+1) % log_freq == 0:
+                    writer.add_scalar(tag='avg_loss', scalar_value=losses[update+1-log_freq:update+1].mean(), global_step=update+1)
+                if (update+1) % checkpoint_freq == 0:
+                    torch.save(Qnet.state_dict(), MODEL_DIR / 'checkpoints' / f'up{update+1:08d}.pt')
+        except BaseException as error:
+            learner_errors.append(error)
+        finally:
+            learner_done.set()
+
+    learner_thread = threading.Thread(target=learner, daemon=True)
+    learner_thread.start()
+
+    env_hiperparams = {}
+    episode_rewards = []
+    num_transitions = 0
+
+    def store_transitions(message) -> int:
+        arrays = [tensor.numpy() for tensor in message[1]]
+        with buffer_lock:
+            replay_buffer.extend(*arrays)
+        return len(arrays[1])
+
+    try:
+        while not learner_done.is_set():
+            try:
+                message = transitions.get(timeout=0.1)
+            except queue.Empty:
+                if not any(actor.is_alive() for actor in actors):
+                    raise RuntimeError('all actor processes exited')
+                continue
+
+            if message[0] == 'transitions':
+                num_transitions += store_transitions(message)
+            elif message[0] == 'episode':
+                _, actor_id, avg_reward, epsilon = message
+                if shared_buffer:
+                    num_transitions = replay_buffer.num_appended()
+                episode_rewards.append(avg_reward)
+                writer.add_scalar(tag='avg_reward', scalar_value=avg_reward, global_step=len(episode_rewards))
+                writer.add_scalar(tag='epsilon', scalar_value=epsilon, global_step=len(episode_rewards))
+                print(f'actor {actor_id} episode done -- {avg_reward = :.2f} -- {epsilon = :.2f} -- {num_transitions = }')
+            elif message[0] == 'hiperparams':
+                env_hiperparams = message[1]
+    finally:
+        learner_done.set()
+        learner_thread.join()
+        stop.set()
+        # actors may be blocked on a full queue, their last chunks are still stored
+        num_done = 0
+        while num_done < num_actors:
+            try:
+                message = transitions.get(timeout=0.1)
+            except queue.Empty:
+                if not any(actor.is_alive() for actor in actors):
+                    break
+                continue
+            if message[0] == 'hiperparams':
+                env_hiperparams = message[1]
+            elif message[0] == 'transitions':
+                num_transitions += store_transitions(message)
+            elif message[0] == 'done':
+                num_done += 1
+        drained.set()
+        for actor in actors:
+            actor.join()
+        writer.close()
+        if shared_buffer:
+            num_transitions = replay_buffer.num_appended()
+            replay_buffer.unlink()
+
+    if learner_errors:
+        raise learner_errors[0]
+
+    # saving
+
+    learning_hiperparams = {
+        'environment': Environment_Traffic_Lights.__name__,
+        'learning_method': 'Asynchronous actor-learner ' + ('Double Deep Q-Learning' if double else 'Deep Q-Learning'),
+        'num_actors': num_actors,
+        'shared_buffer': shared_buffer,
+        'num_updates': num_updates,
+        'num_transitions': num_transitions,
+        'max_timesteps': max_timesteps,
+        'min_buffer_lenth': min_buffer_length,
+        'max_buffer_length': max_buffer_length,
+        'batch_size': batch_size,
+        'gradient_steps': gradient_steps,
+        'target_net_update_freq': target_net_update_freq,
+        'weights_sync_freq': weights_sync_freq,
+        'gamma': gamma,
+        'max_epsilon': max_eps,
+        'min_epsilon': min_eps,
+        'epsilon_decay': eps_decay,
+        'device': device,
+        'experiment_seed': seed
+    }
+    hiperparams = {**env_kwargs, 'state_class': state_class.__name__, 'reward_class': reward_class.__name__,
+                   **env_hiperparams, **learning_hiperparams}
+    hiperparams['route_file'] = route_file
+    hiperparams['model'] = Qnet.hiperparams()
+    hiperparams['optimizer'] = optimizer_hiperparams
+    hiperparams['loss'] = loss.__class__.__name__
+    hiperparams["learning_duration[s]"] = int(time.time()) - learning_start
+
+    np.save(MODEL_DIR / 'update_loss.npy', losses)
+    np.save(MODEL_DIR / 'avg_episode_reward.npy', np.array(episode_rewards))
+    torch.save(Qnet.state_dict(), MODEL_DIR / 'checkpoints' / 'final.pt')
+    with open(MODEL_DIR / 'hiperparams.json', 'w') as f:
+        json.dump(hiperparams, f, indent=2)
+
+    print(f'learning duration: {hiperparams["learning_duration[s]"]} [s], transitions: {num_transitions}, updates: {num_updates}')
+
+    return MODEL_DIR
+
+
+if __name__ == '__main__':
+    from states import QueueState
+    from rewards import NegQueueReward
+
+    model_dir = run_actor_learner(QueueState, NegQueueReward, num_actors=2, num_updates=2000, min_buffer_length=500,
+                                  max_timesteps=500, max_steps=500, route_car_freq=[0.02, 0.05, 0.01]*4, seed=0)
+    print(model_dir)
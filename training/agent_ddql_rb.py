@@ -13,6 +13,8 @@ from states import QueueState
 from rewards import NegQueueReward
 from memory import ReplayBuffer
 from models import DQN_3h
+from trainer import DQNTrainer
+from policy import GreedyPolicy
 
 # env parameters
 STATE_CLASS = QueueState
@@ -35,6 +37,7 @@ MIN_BUFFER_LENGTH = 10000
 MAX_BUFFER_LENGTH = 50000
 TRAIN_FREQ = 10
 BATCH_SIZE = 32
+GRADIENT_STEPS = 1
 
 HIDDEN_LAYERS = [128,32,8]
 OPTIMIZER_LR = 0.0008
@@ -80,6 +83,7 @@ learning_hiperparams = {
     'max_buffer_length': MAX_BUFFER_LENGTH,
     'train_freq': TRAIN_FREQ,
     'batch_size': BATCH_SIZE,
+    'gradient_steps': GRADIENT_STEPS,
     'target_net_update_freq': TARGET_NET_UPDATE_FREQ,
     'gamma': GAMMA,
     'max_epsilon': MAX_EPS,
@@ -98,7 +102,10 @@ writer = SummaryWriter(log_dir=f'runs/{env.__class__.__name__}/run{START_TIME}',
 
 # -------------------------------------------------------------------------------------
 
+policy = GreedyPolicy(Qnet, device=DEVICE)
 replay_buffer = ReplayBuffer(MAX_BUFFER_LENGTH, device=DEVICE)
+trainer = DQNTrainer(Qnet, Qtarget, optimizer, replay_buffer, loss=loss, batch_size=BATCH_SIZE, gamma=GAMMA,
+                     gradient_steps=GRADIENT_STEPS, device=DEVICE)
 
 avg_episode_loss_arr = np.zeros(shape=NUM_EPISODES)
 avg_episode_reward_arr = np.zeros(shape=NUM_EPISODES)
@@ -115,14 +122,11 @@ for episode in range(0,NUM_EPISODES):
     loss_idx = 0
 
     for t in tqdm.trange(MAX_TIMESTEPS, position=0, leave=True):
-    
-        optimizer.zero_grad()
 
-        with torch.no_grad():
-            if np.random.rand() <= epsilon:
-                action = np.random.choice(NUM_ACTIONS)
-            else:
-                action = torch.argmax(Qnet(torch.Tensor(s_t).to(DEVICE)), dim=0).item()
+        if np.random.rand() <= epsilon:
+            action = np.random.choice(NUM_ACTIONS)
+        else:
+            action = policy.act(s_t)
 
         s_t1, r_t, done, info = env.step(action)
         s_t1 = np.array(s_t1)
@@ -134,28 +138,11 @@ for episode in range(0,NUM_EPISODES):
         #     print(f' | {t=:4d} - {a=:>4s} - {s_t=} - {r_t=} - {Qtable[s_t]=}')
 
         if len(replay_buffer)>MIN_BUFFER_LENGTH and t%TRAIN_FREQ==0:
-            _states, _actions, _rewards, _next_states, _dones = replay_buffer.sample(size=BATCH_SIZE)
-
-            _qvalues_all = Qnet(_states)
-            _qvalues_actions = _qvalues_all[np.arange(BATCH_SIZE), _actions]
-            
-            with torch.no_grad():
-                _qvalues_next_all = Qtarget(_next_states)
-                _qvalues_next_max = torch.max(_qvalues_next_all, axis=1)[0]
-                _qvalues_next_max[_dones] = 0
-
-                _qvalues_expected = _rewards + GAMMA * _qvalues_next_max
-                # _qvalues_expected = _qvalues_expected.detach()
-            
-            _loss = loss(_qvalues_expected, _qvalues_actions)
-            _loss.backward()
-            optimizer.step()
-            
-            episode_losses[loss_idx] = _loss.detach().cpu()
+            episode_losses[loss_idx] = trainer.update()
             loss_idx += 1
         
         if t%TARGET_NET_UPDATE_FREQ==0:
-            Qtarget.load_state_dict(Qnet.state_dict())
+            trainer.sync_target()
 
         episode_rewards[t] = r_t
         
@@ -8,8 +8,13 @@ import json, time, keyboard, tqdm, sys
 import matplotlib.pyplot as plt
 import seaborn as sn
 import importlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 
 from rewards import get_metrics_tuple
+from vector_env import worker_route_file
+from scenarios import Scenario, ResultsCache, file_digest
+from policy import GreedyPolicy
 
 envs = importlib.import_module('traffic_envs')
 models = importlib.import_module('models')
@@ -17,6 +22,14 @@ states = importlib.import_module('states')
 rewards = importlib.import_module('rewards')
 
 
+def last_checkpoint_file(model_dir: Path) -> Path:
+    """ final.pt when training finished, otherwise the latest episode (ep*) or update (up*) checkpoint """
+    checkpoints_dir = Path(model_dir) / 'checkpoints'
+    if (checkpoints_dir / 'final.pt').exists():
+        return checkpoints_dir / 'final.pt'
+    return sorted(checkpoints_dir.iterdir())[-1]
+
+
 class Agent:
     """
     universal agent interface for loading and testing trained agents
@@ -38,16 +51,19 @@ class Agent:
         self._MODEL_CLASS = getattr(models, self._hp['model']['name'])
         self._MODEL = self._MODEL_CLASS(**self._hp['model'])
         self.load_last_checkpoint()
+        self._POLICY = GreedyPolicy(self._MODEL)
         
         self._observed_state = None
         
     def observe(self, state):
         self._observed_state = state
         
-    def act(self):
-        with torch.no_grad():
-            action = torch.argmax(self._MODEL(torch.Tensor(self._observed_state)))
-            return action
+    def act(self) -> int:
+        return self._POLICY.act(self._observed_state)
+    
+    def act_batch(self, states: np.ndarray) -> np.ndarray:
+        """ greedy actions for a batch of observations, e.g. from a VectorEnv """
+        return self._POLICY.act_batch(states)
     
     def load_checkpoint(self, episode:int):
         if (self._DIR / 'checkpoints' / f'ep{episode}.pt').exists():
@@ -58,7 +74,7 @@ class Agent:
             self._MODEL.load_state_dict(torch.load(filename))
     
     def load_last_checkpoint(self):
-        self._MODEL.load_state_dict(torch.load(list((self._DIR / 'checkpoints').iterdir())[-1]))
+        self._MODEL.load_state_dict(torch.load(last_checkpoint_file(self._DIR)))
     
     def build_environment(self, **kwargs):
         """ note that provided kwargs have higher priotity """
@@ -87,7 +103,7 @@ def test_agent(model_dir: Union[str,Path], checkpoint_episode: Union[int,str] =
     avg_reward = 0
     rewards = []
     
-    metrics = {m(): [] for m in metric_classes}
+    metrics = {m(environment.observer()): [] for m in metric_classes}
 
     s_t = environment.reset()
 
@@ -153,7 +169,40 @@ def test_agent(model_dir: Union[str,Path], checkpoint_episode: Union[int,str] =
     environment.close()
 
 
-def models_summaries(models_dir: Union[str,Path], timesteps: int = 1000, metric_classes: list = None, seed: int = None) -> pd.DataFrame:
+def _model_summary(model_dir: Path, timesteps: int, metric_classes: list, seed: int, route_file: str,
+                   env_params: Union[None, dict] = None) -> pd.DataFrame:
+    """ evaluates a single model, run either in-process or in a worker process (with its own SUMO) """
+    if seed is not None: 
+        np.random.seed(seed)
+    
+    # with a seed, every model is evaluated on the same cached route file
+    return test_agent(model_dir=model_dir, checkpoint_episode=-1,
+                      max_timesteps=timesteps, gui=False,
+                      verbose=False, summary=True, show=False, 
+                      metric_classes=metric_classes, route_file=route_file, **{"seed": seed, **(env_params or {})})
+
+
+def model_cache_key(model_dir: Path, timesteps: int, metric_classes: list, seed: int, 
+                    scenario: Union[None, Scenario] = None) -> str:
+    """ identifies an evaluation by model, its checkpoint contents, scenario and metrics """
+    return ResultsCache.key(model=Path(model_dir).name,
+                            hiperparams=file_digest(Path(model_dir) / 'hiperparams.json'),
+                            checkpoint=file_digest(last_checkpoint_file(model_dir)),
+                            scenario=None if scenario is None else scenario.key(),
+                            timesteps=timesteps, seed=seed,
+                            metrics=[m.__name__ for m in metric_classes])
+
+
+def models_summaries(models_dir: Union[str,Path], timesteps: int = 1000, metric_classes: list = None, seed: int = None,
+                     workers: int = 1, route_file: str = 'intersection/my_net.rou.xml', 
+                     scenario: Union[None, Scenario] = None, results_cache: Union[None, ResultsCache] = None) -> pd.DataFrame:
+    """ 
+    evaluates every model in models_dir, with workers > 1 models are spread over a process pool \\
+    rows keep the directory order, so under a fixed seed both paths give identical results \\
+    scenario overrides timesteps, seed and traffic of every model, \\
+    models with a result in results_cache (same checkpoint, scenario and metrics) are not simulated again,
+    unseeded evaluations differ from run to run and bypass the cache
+    """
     
     if not isinstance(models_dir, Path):
         models_dir = Path(models_dir)
@@ -161,22 +210,37 @@ def models_summaries(models_dir: Union[str,Path], timesteps: int = 1000, metric_
     if metric_classes is None:
         metric_classes = get_metrics_tuple()
     
-    dfs = []
+    env_params = None
+    if scenario is not None:
+        scenario.materialize()
+        timesteps, seed, env_params = scenario.max_timesteps, scenario.seed, scenario.env_params()
+    if seed is None:
+        results_cache = None
     
-    for model_dir in models_dir.iterdir():
-        
-        if not (model_dir / "hiperparams.json").exists():
-            continue
-        
-        if seed is not None: 
-            np.random.seed(seed)
-        
-        df = test_agent(model_dir=model_dir, checkpoint_episode=-1,
-                        max_timesteps=timesteps, gui=False,
-                        verbose=False, summary=True, show=False, 
-                        metric_classes=metric_classes)
-
-        dfs.append(df)
+    model_dirs = [model_dir for model_dir in models_dir.iterdir() if (model_dir / "hiperparams.json").exists()]
+    
+    dfs = [None] * len(model_dirs)
+    keys = [None] * len(model_dirs)
+    if results_cache is not None:
+        for i, model_dir in enumerate(model_dirs):
+            keys[i] = model_cache_key(model_dir, timesteps, metric_classes, seed, scenario)
+            dfs[i] = results_cache.get(keys[i])
+    missing = [i for i, df in enumerate(dfs) if df is None]
+    
+    if workers <= 1:
+        for i in missing:
+            dfs[i] = _model_summary(model_dirs[i], timesteps, metric_classes, seed, route_file, env_params)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn')) as pool:
+            futures = {i: pool.submit(_model_summary, model_dirs[i], timesteps, metric_classes, seed, 
+                                      worker_route_file(route_file, i), env_params)
+                       for i in missing}
+            for i, future in futures.items():
+                dfs[i] = future.result()
+    
+    if results_cache is not None:
+        for i in missing:
+            results_cache.put(keys[i], dfs[i])
         
     return pd.concat(dfs, ignore_index=True)
     
@@ -199,7 +263,7 @@ if __name__=="__main__":
     # np.random.seed()
     
     # test_models_dir = Path("models/environment_traffic_lights")
-    # df = models_summaries(models_dir=test_models_dir, timesteps=1000, seed=0)
+    # df = models_summaries(models_dir=test_models_dir, timesteps=1000, seed=0, workers=4)
     # print(df)
     
     # df.to_excel(test_models_dir / "summaries.xlsx")
@@ -78,7 +78,7 @@ def test_baseline_agent(env_class: str, agent_class: Baseline_Agent, env_params:
     avg_reward = 0
     rewards = []
     
-    metrics = {m(): [] for m in metric_classes}
+    metrics = {m(env.observer()): [] for m in metric_classes}
     
     s_t = env.reset()
     
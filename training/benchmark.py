@@ -0,0 +1,177 @@
+import argparse, json, platform, subprocess, tempfile, time
+import numpy as np
+import torch
+import torch.nn as nn
+from pathlib import Path
+from typing import List, Union
+
+from traffic_envs import Environment_Traffic_Lights
+from generator import TrafficGenerator
+from memory import ReplayBuffer, MemoryPalace
+from models import DQN_3h
+from trainer import DQNTrainer
+from policy import GreedyPolicy
+import states, rewards
+
+STATE_CLASSES = [states.SpeedState, states.QueueState, states.CountState, states.WaitState, states.QueueWaitState]
+REWARD_CLASSES = [rewards.WaitDiffReward, rewards.QueueDiffReward, rewards.CountDiffReward, rewards.NegWaitReward,
+                  rewards.NegQueueReward, rewards.SpeedReward, rewards.ThroughputReward]
+ROUTE_CAR_FREQ = [0.02, 0.05, 0.01]*4
+
+
+def _git_commit() -> Union[None, str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _env(state_class, reward_class, steps: int, backend: str, cache_dir: str, **kwargs) -> Environment_Traffic_Lights:
+    # route files stay in the temporary directory, the repository's route file is not touched
+    return Environment_Traffic_Lights(state_class, reward_class, max_steps=steps, route_car_freq=ROUTE_CAR_FREQ,
+                                      backend=backend, seed=0, route_cache_dir=cache_dir,
+                                      route_file=str(Path(cache_dir).parent / 'bench.rou.xml'), **kwargs)
+
+
+def bench_env_steps(steps: int, backend: str, cache_dir: str) -> dict:
+    """ steps/s of every State class (with NegQueueReward) and every Reward class (with QueueState) """
+    def steps_per_second(state_class, reward_class) -> float:
+        env = _env(state_class, reward_class, steps, backend, cache_dir)
+        actions = np.random.RandomState(0).randint(4, size=steps).tolist()
+        start = time.perf_counter()
+        for action in actions:
+            env.step(action)
+        elapsed = time.perf_counter() - start
+        env.close()
+        return steps / elapsed
+
+    return {
+        'states': {c.__name__: steps_per_second(c, rewards.NegQueueReward) for c in STATE_CLASSES},
+        'rewards': {c.__name__: steps_per_second(states.QueueState, c) for c in REWARD_CLASSES},
+    }
+
+
+def bench_reset(resets: int, backend: str, cache_dir: str) -> dict:
+    """ mean reset latency [ms] with a cached route file and with route injection """
+    result = {}
+    for mode, kwargs in (('file', {}), ('injection', {'route_injection': True})):
+        env = _env(states.QueueState, rewards.NegQueueReward, 1000, backend, cache_dir, **kwargs)
+        start = time.perf_counter()
+        for _ in range(resets):
+            env.reset()
+        result[mode] = (time.perf_counter() - start) / resets * 1e3
+        env.close()
+    return result
+
+
+def bench_generator(horizons: List[int], tmp_dir: str) -> dict:
+    """ route file generation time [ms] per horizon [s] """
+    result = {}
+    for horizon in horizons:
+        generator = TrafficGenerator(max_steps=horizon, route_car_freq=ROUTE_CAR_FREQ)
+        start = time.perf_counter()
+        generator.generate_route_file(seed=0, route_file=str(Path(tmp_dir) / f'bench_{horizon}.rou.xml'))
+        result[str(horizon)] = (time.perf_counter() - start) * 1e3
+    return result
+
+
+def bench_replay(capacities: List[int], batch_size: int = 32, samples: int = 1000) -> dict:
+    """ mean sample latency [us] of ReplayBuffer and MemoryPalace filled to capacity """
+    result = {}
+    for buffer_class in (ReplayBuffer, MemoryPalace):
+        result[buffer_class.__name__] = {}
+        for capacity in capacities:
+            buffer = buffer_class(capacity, device='cpu')
+            for i in range(capacity):
+                buffer.append((np.zeros(16), i % 4, 0., np.zeros(16), False))
+            start = time.perf_counter()
+            for _ in range(samples):
+                buffer.sample(batch_size)
+            result[buffer_class.__name__][str(capacity)] = (time.perf_counter() - start) / samples * 1e6
+    return result
+
+
+def bench_training(steps: int, backend: str, cache_dir: str, train_freq: int = 10, batch_size: int = 32) -> dict:
+    """ end-to-end steps/s of the DDQL training loop (epsilon 0.5, updates every train_freq steps) """
+    torch.manual_seed(0)
+    rng = np.random.RandomState(0)
+    env = _env(states.QueueState, rewards.NegQueueReward, steps, backend, cache_dir)
+    Qnet, Qtarget = DQN_3h(input_size=16, output_size=4), DQN_3h(input_size=16, output_size=4)
+    optimizer = torch.optim.Adam(Qnet.parameters(), lr=0.0008)
+    replay_buffer = ReplayBuffer(steps, device='cpu')
+    trainer = DQNTrainer(Qnet, Qtarget, optimizer, replay_buffer, loss=nn.HuberLoss(), batch_size=batch_size)
+    policy = GreedyPolicy(Qnet)
+
+    s_t = np.array(env.reset())
+    start = time.perf_counter()
+    for t in range(steps):
+        action = rng.randint(4) if rng.rand() <= 0.5 else policy.act(s_t)
+        s_t1, r_t, done, _ = env.step(action)
+        s_t1 = np.array(s_t1)
+        replay_buffer.append((s_t, action, r_t, s_t1, done))
+        if len(replay_buffer) > batch_size and t % train_freq == 0:
+            trainer.update()
+        s_t = s_t1
+    elapsed = time.perf_counter() - start
+    env.close()
+    return {'steps_per_second': steps / elapsed, 'env_timings': env.timings().report(),
+            'trainer_timings': trainer.timings().report()}
+
+
+def run_benchmarks(backend: str = 'libsumo', quick: bool = False) -> dict:
+    """ runs every benchmark headless and returns the results with machine and version info """
+    env_steps, resets, train_steps = (100, 5, 300) if quick else (1000, 20, 3000)
+    horizons = [1000, 8000] if quick else [1000, 8000, 80000]
+    capacities = [10000] if quick else [10000, 50000, 100000]
+
+    results = {
+        'commit': _git_commit(),
+        'timestamp': int(time.time()),
+        'backend': backend,
+        'quick': quick,
+        'machine': {'platform': platform.platform(), 'processor': platform.processor(), 'python': platform.python_version(),
+                    'numpy': np.__version__, 'torch': torch.__version__},
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_dir = str(Path(tmp_dir) / 'route_cache')
+        results['env_steps_per_second'] = bench_env_steps(env_steps, backend, cache_dir)
+        results['reset_ms'] = bench_reset(resets, backend, cache_dir)
+        results['generator_ms'] = bench_generator(horizons, tmp_dir)
+        results['replay_sample_us'] = bench_replay(capacities)
+        results['training'] = bench_training(train_steps, backend, cache_dir)
+    return results
+
+
+def compare(old_file: Union[str, Path], new_file: Union[str, Path]):
+    """ prints new/old ratios of every numeric result present in both files """
+    def flatten(d: dict, prefix: str = '') -> dict:
+        flat = {}
+        for k, v in d.items():
+            if isinstance(v, dict):
+                flat.update(flatten(v, f'{prefix}{k}/'))
+            elif isinstance(v, (int, float)) and not isinstance(v, bool):
+                flat[f'{prefix}{k}'] = v
+        return flat
+
+    old, new = (flatten(json.loads(Path(f).read_text())) for f in (old_file, new_file))
+    for key in old:
+        if key in new and key != 'timestamp' and old[key]:
+            print(f'{key:60s} {old[key]:12.3f} -> {new[key]:12.3f}  ({new[key]/old[key]:.2f}x)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='environment and training throughput benchmarks')
+    parser.add_argument('--backend', default='libsumo', choices=['traci', 'libsumo'])
+    parser.add_argument('--quick', action='store_true', help='shorter runs, for a smoke check')
+    parser.add_argument('-o', '--out', default=None, help='results file, benchmarks/<commit>_<backend>.json by default')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two results files instead')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        results = run_benchmarks(args.backend, args.quick)
+        out_file = Path(args.out or f'benchmarks/{(results["commit"] or "local")[:10]}_{args.backend}.json')
+        out_file.parent.mkdir(parents=True, exist_ok=True)
+        out_file.write_text(json.dumps(results, indent=2))
+        print(f'results: {out_file}')
@@ -0,0 +1,9 @@
+import os
+from pathlib import Path
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def training_dir(monkeypatch):
+    """ modules use paths relative to training/ (intersection/..., models/...), tests run from there """
+    monkeypatch.chdir(Path(__file__).parent)
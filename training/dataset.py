@@ -0,0 +1,224 @@
+import json, os
+import numpy as np
+from pathlib import Path
+from typing import Iterator, List, Tuple, Union
+
+from observation import LaneObserver
+from memory import ExpTuple
+
+
+META_FILE = 'meta.json'
+
+
+class ExperienceRecorder:
+    """
+    appends experience tuples together with the raw lane features around them to a dataset directory,
+    one .npy file per column written through np.memmap, read back with ExperienceDataset \\
+        recorder = ExperienceRecorder('experience', env.observer())
+        recorder.start()                                # after every env.reset()
+        recorder.append(exp_tuple, env.sim_time())      # after every env.step()
+        recorder.close()
+    all observer lanes are recorded (and tracked) by default, so states and rewards of any lanes can be recomputed \\
+    throughput=True also tracks vehicle ids of incoming lanes and records, per lane, how many vehicles 
+    left the incoming lanes during each step (what ThroughputReward counts) \\
+    an existing dataset is appended to, files grow by doubling when capacity is reached
+    """
+
+    def __init__(self, path: Union[str, Path], observer: LaneObserver, capacity: int = 100000,
+                 lanes: Union[None, List[str]] = None, hiperparams: Union[None, dict] = None, throughput: bool = False):
+        self.path = Path(path)
+        self._observer = observer
+        self.lanes = list(observer.lanes if lanes is None else lanes)
+        self._lane_idx = observer.indices(self.lanes)
+        self._columns = {}
+        self._features = None
+        self._throughput = throughput
+
+        if (self.path / META_FILE).exists():
+            self._meta = json.loads((self.path / META_FILE).read_text())
+            if (self._meta['lanes'] != self.lanes or self._meta['features'] != list(LaneObserver.COLUMNS) 
+                    or ('throughput' in self._meta['columns']) != throughput):
+                raise ValueError(f'{self.path} holds a dataset of different lanes or features')
+            self._columns = {name: np.load(self.path / f'{name}.npy', mmap_mode='r+') for name in self._meta['columns']}
+            self._length = self._meta['length']
+            self._episode = int(self._columns['episodes'][self._length - 1]) if self._length else -1
+        else:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._meta = {'length': 0, 'lanes': self.lanes, 'incoming': [lane for lane in observer.incoming if lane in self.lanes],
+                          'features': list(LaneObserver.COLUMNS), 'columns': [], 'hiperparams': hiperparams or {}}
+            self._length = 0
+            self._episode = -1
+        self._capacity = capacity
+
+        self._incoming = self._meta['incoming']
+        self._incoming_idx = np.array([self.lanes.index(lane) for lane in self._incoming], dtype=np.int64)
+        self._vehicles = None
+        if throughput:
+            observer.track_vehicles(self._incoming)
+
+    def _allocate(self, state: np.ndarray):
+        # columns are created on the first append, when the state shape is known
+        state_shape = np.shape(state)
+        lane_shape = (len(self.lanes), len(LaneObserver.COLUMNS))
+        shapes = {
+            'states': (state_shape, np.float32),
+            'actions': ((), np.int64),
+            'rewards': ((), np.float32),
+            'next_states': (state_shape, np.float32),
+            'dones': ((), bool),
+            'features': (lane_shape, np.float32),
+            'next_features': (lane_shape, np.float32),
+            'times': ((), np.int64),
+            'episodes': ((), np.int64),
+        }
+        if self._throughput:
+            shapes['throughput'] = ((len(self.lanes),), np.int64)
+        for name, (shape, dtype) in shapes.items():
+            self._columns[name] = np.lib.format.open_memmap(self.path / f'{name}.npy', mode='w+', dtype=dtype,
+                                                            shape=(self._capacity, *shape))
+        self._meta['columns'] = list(shapes)
+
+    def _grow(self):
+        for name, column in self._columns.items():
+            tmp_file = self.path / f'{name}.{os.getpid()}.tmp.npy'
+            grown = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=column.dtype, shape=(2 * len(column), *column.shape[1:]))
+            grown[:len(column)] = column
+            grown.flush()
+            del grown
+            os.replace(tmp_file, self.path / f'{name}.npy')
+            self._columns[name] = np.load(self.path / f'{name}.npy', mmap_mode='r+')
+
+    def start(self):
+        """ begins a new episode, features before its first transition are read from the observer """
+        self._features = self._observer.features(self._lane_idx)
+        if self._throughput:
+            self._vehicles = [self._observer.vehicles([lane]) for lane in self._incoming]
+        self._episode += 1
+
+    def append(self, experience_tuple: ExpTuple, time: int = 0):
+        """ writes one transition, time is the SUMO time after it """
+        state, action, reward, next_state, done = experience_tuple
+        if self._features is None:
+            self.start()
+        if not self._columns:
+            self._allocate(state)
+        elif self._length == len(self._columns['actions']):
+            self._grow()
+
+        next_features = self._observer.features(self._lane_idx)
+        idx = self._length
+        self._columns['states'][idx] = state
+        self._columns['actions'][idx] = action
+        self._columns['rewards'][idx] = reward
+        self._columns['next_states'][idx] = next_state
+        self._columns['dones'][idx] = done
+        self._columns['features'][idx] = self._features
+        self._columns['next_features'][idx] = next_features
+        self._columns['times'][idx] = time
+        self._columns['episodes'][idx] = self._episode
+        if self._throughput:
+            self._columns['throughput'][idx] = self._left_vehicles()
+        self._features = next_features
+        self._length += 1
+
+    def _left_vehicles(self) -> np.ndarray:
+        # vehicles on a lane before the step and on none of the incoming lanes after it
+        vehicles = [self._observer.vehicles([lane]) for lane in self._incoming]
+        remaining = set().union(*vehicles)
+        left = np.zeros(len(self.lanes), dtype=np.int64)
+        left[self._incoming_idx] = [len(old - remaining) for old in self._vehicles]
+        self._vehicles = vehicles
+        return left
+
+    def flush(self):
+        """ writes pending data and the dataset length, readers see transitions up to here """
+        for column in self._columns.values():
+            column.flush()
+        self._meta['length'] = self._length
+        tmp_file = self.path / f'{META_FILE}.{os.getpid()}.tmp'
+        tmp_file.write_text(json.dumps(self._meta, indent=2))
+        os.replace(tmp_file, self.path / META_FILE)
+
+    def close(self):
+        self.flush()
+        self._columns = {}
+
+    def __len__(self) -> int:
+        return self._length
+
+
+class ExperienceDataset:
+    """
+    read-only view of a recorded dataset, columns stay memory-mapped and are read in chunks: \\
+        states, actions, rewards, next_states, dones -- experience tuples as recorded \\
+        features, next_features -- raw lane features (transitions, lanes, features) before and after each step \\
+        times, episodes -- SUMO time after each step and episode number \\
+        throughput -- (optional) vehicles that left the incoming lanes during each step, per lane \\
+    with a state_class or reward_class given, states and rewards are recomputed from the raw lane features
+    through from_features (ThroughputReward from the throughput column), without running SUMO \\
+    recomputed rewards are exact for action_repeat=1 and skip_idle=False, diff rewards also for action_repeat > 1
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._meta = json.loads((self.path / META_FILE).read_text())
+        self.lanes : List[str] = self._meta['lanes']
+        self.incoming : List[str] = self._meta['incoming']
+        self.features : List[str] = self._meta['features']
+        self._lane_index = {lane: i for i, lane in enumerate(self.lanes)}
+        self._length = self._meta['length']
+        self._columns = {name: np.load(self.path / f'{name}.npy', mmap_mode='r')[:self._length]
+                         for name in self._meta['columns']}
+
+    def __len__(self) -> int:
+        return self._length
+
+    def hiperparams(self) -> dict:
+        return self._meta['hiperparams']
+
+    def column(self, name: str) -> np.ndarray:
+        """ memory-mapped column, nothing is read before it is indexed """
+        return self._columns[name]
+
+    def lane_indices(self, lanes: List[str]) -> np.ndarray:
+        missing = [lane for lane in lanes if lane not in self._lane_index]
+        if missing:
+            raise ValueError(f'lanes {missing} were not recorded')
+        return np.array([self._lane_index[lane] for lane in lanes], dtype=np.int64)
+
+    def _class_lanes(self, cls, lanes: Union[None, List[str]]) -> np.ndarray:
+        return self.lane_indices(cls.default_lanes(self) if lanes is None else lanes)
+
+    def states(self, state_class=None, lanes: Union[None, List[str]] = None, start: int = 0,
+               stop: Union[None, int] = None, next_states: bool = False) -> np.ndarray:
+        """ recorded states in [start, stop), or state_class states of the recorded lane features """
+        if state_class is None:
+            return np.asarray(self._columns['next_states' if next_states else 'states'][start:stop])
+        features = self._columns['next_features' if next_states else 'features'][start:stop]
+        return state_class.from_features(np.asarray(features), self._class_lanes(state_class, lanes)).astype(np.float32)
+
+    def rewards(self, reward_class=None, lanes: Union[None, List[str]] = None, start: int = 0,
+                stop: Union[None, int] = None) -> np.ndarray:
+        """ recorded rewards in [start, stop), or reward_class rewards of the recorded lane features """
+        if reward_class is None:
+            return np.asarray(self._columns['rewards'][start:stop])
+        if hasattr(reward_class, 'from_throughput'):
+            if 'throughput' not in self._columns:
+                raise ValueError(f'{self.path} was recorded without throughput')
+            throughput = np.asarray(self._columns['throughput'][start:stop])
+            return reward_class.from_throughput(throughput, self._class_lanes(reward_class, lanes)).astype(np.float32)
+        features_t = np.asarray(self._columns['features'][start:stop])
+        features_t1 = np.asarray(self._columns['next_features'][start:stop])
+        return reward_class.from_features(features_t, features_t1, self._class_lanes(reward_class, lanes)).astype(np.float32)
+
+    def chunks(self, chunk_size: int = 4096, state_class=None, reward_class=None,
+               start: int = 0, stop: Union[None, int] = None) -> Iterator[Tuple[np.ndarray]]:
+        """ yields (states, actions, rewards, next_states, dones) arrays of at most chunk_size transitions """
+        stop = self._length if stop is None else min(stop, self._length)
+        for chunk_start in range(start, stop, chunk_size):
+            chunk_stop = min(chunk_start + chunk_size, stop)
+            yield (self.states(state_class, start=chunk_start, stop=chunk_stop),
+                   np.asarray(self._columns['actions'][chunk_start:chunk_stop]),
+                   self.rewards(reward_class, start=chunk_start, stop=chunk_stop),
+                   self.states(state_class, start=chunk_start, stop=chunk_stop, next_states=True),
+                   np.asarray(self._columns['dones'][chunk_start:chunk_stop]))
@@ -1,4 +1,6 @@
 from pathlib import Path
+from typing import Union
+import os
 import numpy as np
 import pandas as pd
 
@@ -6,9 +8,11 @@ from baseline_agent import Alternating_Phases, test_baseline_agent
 from agent_testing import models_summaries
 from rewards import NegQueueReward, get_metrics_tuple
 from states import QueueState
+from scenarios import Scenario, ResultsCache, get_scenario
 
 
-def test_baseline(timesteps: int = 1000):
+def test_baseline(timesteps: int = 1000, scenario: Union[None, Scenario] = None, 
+                  results_cache: Union[None, ResultsCache] = None):
     agent_class = Alternating_Phases
     env_class = 'Environment_Traffic_Lights'
     
@@ -19,24 +23,43 @@ def test_baseline(timesteps: int = 1000):
         "state_class": QueueState,
         "reward_class": NegQueueReward
     }
+    if scenario is not None:
+        scenario.materialize()
+        timesteps = scenario.max_timesteps
+        env_params.update(scenario.env_params())
     
     agent_params = {
         "phases_durations": [7, 3, 7, 3]
     }
+    metric_classes = get_metrics_tuple()
+    
+    if results_cache is not None:
+        key = ResultsCache.key(agent=agent_class.__name__, agent_params=agent_params, env_class=env_class,
+                               env_params={k: getattr(v, '__name__', v) for k, v in env_params.items()},
+                               scenario=None if scenario is None else scenario.key(), timesteps=timesteps,
+                               metrics=[m.__name__ for m in metric_classes])
+        df = results_cache.get(key)
+        if df is not None:
+            return df
     
     np.random.seed(0)
     df = test_baseline_agent(env_class=env_class, agent_class=agent_class, 
                              env_params=env_params, agent_params=agent_params, 
                              max_timesteps=timesteps, verbose=False, verbose_freq=50, gui=False, 
-                             summary=True, show=False, metric_classes=get_metrics_tuple())
+                             summary=True, show=False, metric_classes=metric_classes)
+    
+    if results_cache is not None:
+        results_cache.put(key, df)
     
     return df    
 
 
-def test_models(timesteps: int = 1000): 
+def test_models(timesteps: int = 1000, workers: int = 1, scenario: Union[None, Scenario] = None,
+                results_cache: Union[None, ResultsCache] = None): 
     test_models_dir = Path("models/environment_traffic_lights")
     
-    df = models_summaries(models_dir=test_models_dir, timesteps=timesteps, seed=0)
+    df = models_summaries(models_dir=test_models_dir, timesteps=timesteps, seed=0, workers=workers,
+                          scenario=scenario, results_cache=results_cache)
 
     return df
 
@@ -44,9 +67,12 @@ def test_models(timesteps: int = 1000):
 if __name__=="__main__":
     
     TIMESTEPS = 1000
+    WORKERS = os.cpu_count()
+    SCENARIO = get_scenario("default")
+    RESULTS_CACHE = ResultsCache("models/environment_traffic_lights/evaluation_cache")
     
-    baseline_df = test_baseline(TIMESTEPS)
-    models_df = test_models(TIMESTEPS)
+    baseline_df = test_baseline(TIMESTEPS, SCENARIO, RESULTS_CACHE)
+    models_df = test_models(TIMESTEPS, WORKERS, SCENARIO, RESULTS_CACHE)
     
     df = pd.concat([models_df, baseline_df], ignore_index=True)
     
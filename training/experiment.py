@@ -0,0 +1,239 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from pathlib import Path
+from typing import List, Union
+import tqdm
+import time
+import json
+import torch
+import torch.nn as nn
+from torch.utils.tensorboard import SummaryWriter
+
+from traffic_envs import Environment_Traffic_Lights
+from states import State
+from rewards import Reward
+from memory import ReplayBuffer
+from dataset import ExperienceRecorder, ExperienceDataset
+from models import DQN_3h
+from trainer import DQNTrainer
+from policy import GreedyPolicy
+from profiling import Timings
+
+
+def make_model_dir(env_name: str) -> Path:
+    """ creates models/<env>/<timestamp>, moving to the next free second when runs start together """
+    start_time = int(time.time())
+    while True:
+        model_dir = Path(f'models/{env_name.lower()}/{start_time}')
+        try:
+            model_dir.mkdir(parents=True, exist_ok=False)
+            break
+        except FileExistsError:
+            start_time += 1
+    (model_dir / 'checkpoints').mkdir(parents=True, exist_ok=True)
+    return model_dir
+
+
+def check_state_shape(state_shape: Union[None, int], env_state_size: int) -> int:
+    """ Q-network input size, the environment's state size unless given, a given one has to match it """
+    if state_shape is None:
+        return env_state_size
+    if state_shape != env_state_size:
+        raise ValueError(f'state_shape {state_shape} does not match the state size {env_state_size} of the environment')
+    return state_shape
+
+
+def run_experiment(state_class: State, reward_class: Reward, experiment_number: int = 0, num_experiments: int = 1,
+                   seed: Union[None, int] = None, double: bool = True,
+                   # env parameters
+                   max_steps: int = 10000, route_car_freq: Union[None, List[float]] = None,
+                   sumo_cfg_file: str = 'intersection/my_net.sumocfg', route_file: str = 'intersection/my_net.rou.xml',
+                   gui: bool = False, yellow_duration: int = 4, green_duration: int = 4, backend: str = 'traci',
+                   # training parameters
+                   num_episodes: int = 125, max_timesteps: int = 10000, min_buffer_length: int = 10000,
+                   max_buffer_length: int = 50000, train_freq: int = 10, batch_size: int = 32, gradient_steps: int = 1,
+                   hidden_layers: Union[None, List[int]] = None, optimizer_lr: float = 0.0008,
+                   target_net_update_freq: int = 2500, qnet_checkpoint_freq: int = 25,
+                   gamma: float = 0.99, max_eps: float = 1, min_eps: float = 0.1, eps_decay: float = 0.01,
+                   state_shape: Union[None, int] = None, num_actions: int = 4, device: str = 'cpu',
+                   # experience datasets
+                   record_experience: bool = False, warm_start: Union[None, str] = None) -> Path:
+    """
+    trains one DQN agent for a (state_class, reward_class) pair, returns its model directory \\
+    double=True trains with a target network (DDQL), otherwise Qnet evaluates next states itself \\
+    record_experience=True keeps every transition with raw lane features in <model_dir>/experience, 
+    warm_start fills the replay buffer from such a dataset first (states and rewards recomputed for given classes)
+    """
+    if seed is not None:
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+
+    env = Environment_Traffic_Lights(state_class=state_class, reward_class=reward_class, max_steps=max_steps,
+                                     route_car_freq=route_car_freq, sumo_cfg_file=sumo_cfg_file, route_file=route_file,
+                                     gui=gui, yellow_duration=yellow_duration, green_duration=green_duration,
+                                     backend=backend)
+    state_shape = check_state_shape(state_shape, env.state_size())
+
+    MODEL_DIR = make_model_dir(env.__class__.__name__)
+    START_TIME = int(MODEL_DIR.name)
+    learning_start = int(time.time())
+
+    Qnet = DQN_3h(input_size=state_shape, hidden_sizes=hidden_layers, output_size=num_actions).to(device)
+    Qtarget = None
+    if double:
+        Qtarget = DQN_3h(input_size=state_shape, hidden_sizes=hidden_layers, output_size=num_actions).to(device)
+        Qtarget.load_state_dict(Qnet.state_dict())
+
+    optimizer = torch.optim.Adam(Qnet.parameters(), lr=optimizer_lr)
+    loss = nn.HuberLoss()
+
+    env_hiperparams = env.hiperparams()
+    learning_hiperparams = {
+        'environment': env.__class__.__name__,
+        'learning_method': 'Double Deep Q-Learning with Replay Buffer' if double else 'Deep Q-Learning with Replay Buffer',
+        'num_episodes': num_episodes,
+        'max_timesteps': max_timesteps,
+        'min_buffer_lenth': min_buffer_length,
+        'max_buffer_length': max_buffer_length,
+        'train_freq': train_freq,
+        'batch_size': batch_size,
+        'gradient_steps': gradient_steps,
+        'target_net_update_freq': target_net_update_freq,
+        'gamma': gamma,
+        'max_epsilon': max_eps,
+        'min_epsilon': min_eps,
+        'epsilon_decay': eps_decay,
+        'device': device,
+        'experiment_seed': seed,
+        'record_experience': record_experience,
+        'warm_start': warm_start
+    }
+    hiperparams = {**env_hiperparams, **learning_hiperparams}
+    hiperparams['model'] = Qnet.hiperparams()
+    hiperparams['optimizer'] = {'name': optimizer.__class__.__name__, 'state_dict': optimizer.state_dict()}
+    hiperparams['loss'] = loss.__class__.__name__
+    with open(MODEL_DIR / 'hiperparams.json', 'w') as f:
+        json.dump(hiperparams, f, indent=2)
+
+    writer = SummaryWriter(log_dir=f'../runs/{env.__class__.__name__}/run{START_TIME}_experiment{experiment_number+1}', comment=f'{START_TIME}')
+
+    # -------------------------------------------------------------------------------------
+
+    policy = GreedyPolicy(Qnet, device=device)
+    replay_buffer = ReplayBuffer(max_buffer_length, device=device)
+    if warm_start is not None:
+        num_loaded = replay_buffer.load_dataset(ExperienceDataset(warm_start), state_class, reward_class)
+        print(f'warm start: {num_loaded} transitions from {warm_start}')
+    recorder = None
+    if record_experience:
+        recorder = ExperienceRecorder(MODEL_DIR / 'experience', env.observer(), capacity=num_episodes*max_timesteps,
+                                      hiperparams=env_hiperparams)
+    trainer = DQNTrainer(Qnet, Qtarget, optimizer, replay_buffer, loss=loss, batch_size=batch_size, gamma=gamma,
+                         gradient_steps=gradient_steps, device=device)
+
+    agent_timings = Timings()  # policy inference and replay buffer appends
+    timings = {'env': env.timings(), 'trainer': trainer.timings(), 'agent': agent_timings}
+
+    avg_episode_loss_arr = np.zeros(shape=num_episodes)
+    avg_episode_reward_arr = np.zeros(shape=num_episodes)
+
+    for episode in range(0, num_episodes):
+
+        epsilon = max(max_eps - (episode)*eps_decay, min_eps)
+        print(f'\nEPISODE: {episode+1:3d} of {num_episodes} --> {epsilon = :.2f}      ---      experiment {experiment_number+1} of {num_experiments} --> state: {state_class.desc()}, reward: {reward_class.desc()}')
+
+        s_t = np.array(env.reset())
+        if recorder is not None:
+            recorder.start()
+
+        episode_rewards = np.zeros(shape=max_timesteps)
+        episode_losses = np.zeros(shape=int(np.ceil(max_timesteps/train_freq)))
+        loss_idx = 0
+
+        for t in tqdm.trange(max_timesteps, position=0, leave=True):
+
+            if np.random.rand() <= epsilon:
+                action = np.random.choice(num_actions)
+            else:
+                with agent_timings('inference'):
+                    action = policy.act(s_t)
+
+            s_t1, r_t, done, info = env.step(action)
+            s_t1 = np.array(s_t1)
+            exp_tuple = (s_t, action, r_t, s_t1, done)
+            with agent_timings('replay'):
+                replay_buffer.append(exp_tuple)
+                if recorder is not None:
+                    recorder.append(exp_tuple, env.sim_time())
+
+            if len(replay_buffer)>min_buffer_length and t%train_freq==0:
+                episode_losses[loss_idx] = trainer.update()
+                loss_idx += 1
+
+            if t%target_net_update_freq==0:
+                trainer.sync_target()
+
+            episode_rewards[t] = r_t
+
+            if done:
+                s_t = np.array(env.reset())
+                if recorder is not None:
+                    recorder.start()
+            else:
+                s_t = s_t1
+
+        avg_episode_loss = np.average(episode_losses)
+        avg_episode_loss_arr[episode] = avg_episode_loss
+
+        avg_episode_reward = np.average(episode_rewards)
+        avg_episode_reward_arr[episode] = avg_episode_reward
+
+        writer.add_scalar(tag='avg_episode_loss', scalar_value=avg_episode_loss, global_step=episode)
+        writer.add_scalar(tag='avg_reward', scalar_value=avg_episode_reward, global_step=episode)
+        writer.add_scalar(tag='epsilon', scalar_value=epsilon, global_step=episode)
+        # seconds spent in every section during the episode
+        for component, component_timings in timings.items():
+            for section, seconds in component_timings.totals().items():
+                writer.add_scalar(tag=f'timings/{component}_{section}', scalar_value=seconds, global_step=episode)
+
+        if (episode+1)%qnet_checkpoint_freq==0:
+            torch.save(Qnet.state_dict(), MODEL_DIR / 'checkpoints' / f'ep{episode+1:05d}.pt')
+        if recorder is not None:
+            recorder.flush()
+
+        print(f' --- {avg_episode_loss = :.4f} -- {avg_episode_reward = :.2f}')
+        for component, component_timings in timings.items():
+            print(f'{component} timings:\n{component_timings}')
+            component_timings.reset()
+
+    env.close()
+    writer.close()
+    if recorder is not None:
+        recorder.close()
+
+    # saving
+
+    plt.figure(figsize=(16,8.2))
+    plt.title('Average episode loss'); plt.xlabel('Episode number'); plt.ylabel('Value'), plt.grid()
+    plt.plot(avg_episode_loss_arr)
+    plt.tight_layout()
+    plt.savefig(MODEL_DIR/'avg_episode_loss.png')
+
+    plt.figure(figsize=(16,8.2))
+    plt.title('Average episode reward'); plt.xlabel('Episode number'); plt.ylabel('Value'), plt.grid()
+    plt.plot(avg_episode_reward_arr)
+    plt.tight_layout()
+    plt.savefig(MODEL_DIR/'avg_episode_reward.png')
+    plt.close('all')
+
+    np.save(MODEL_DIR / 'avg_episode_loss.npy', avg_episode_loss_arr)
+    np.save(MODEL_DIR / 'avg_episode_reward.npy', avg_episode_reward_arr)
+    torch.save(Qnet.state_dict(), MODEL_DIR / 'checkpoints' / 'final.pt')  # earlier Qnet only
+
+    hiperparams["learning_duration[s]"] = int(time.time()) - learning_start
+    with open(MODEL_DIR / 'hiperparams.json', 'w') as f:
+        json.dump(hiperparams, f, indent=2)
+
+    print(f'learning duration: {hiperparams["learning_duration[s]"]} [s]')
+
+    return MODEL_DIR
@@ -1,19 +1,8 @@
-import numpy as np
-from itertools import product
-import matplotlib.pyplot as plt
-from pathlib import Path
-import tqdm
-import time
-import keyboard, json
-import torch
-import torch.nn as nn
-from torch.utils.tensorboard import SummaryWriter
-
-from traffic_envs import Environment_Traffic_Lights
 from states import get_states_tuple
 from rewards import get_rewards_tuple
-from memory import ReplayBuffer
-from models import DQN_3h
+from grid_runner import run_grid
+from actor_learner import run_actor_learner
+from itertools import product
 
 # static env parameters
 MAX_STEPS = 10000
@@ -34,10 +23,12 @@ MIN_BUFFER_LENGTH = 10000
 MAX_BUFFER_LENGTH = 50000
 TRAIN_FREQ = 10
 BATCH_SIZE = 32
+GRADIENT_STEPS = 1
 
 HIDDEN_LAYERS = [128,32,8]
 OPTIMIZER_LR = 0.0008
 
+DOUBLE_DQN = True
 TARGET_NET_UPDATE_FREQ = 2500
 QNET_CHECKPOINT_FREQ = 25
 
@@ -46,175 +37,46 @@ MAX_EPS = 1
 MIN_EPS = 0.1
 EPS_DECAY = 0.01
 
-STATE_SHAPE = 4*4
 NUM_ACTIONS = 4
 
 DEVICE = 'cpu'
 
+# sweep parameters
+SEEDS = [None]      # every (state, reward) pair is trained once per seed
+MAX_WORKERS = None  # parallel experiments, one SUMO each; None - all cores, 1 - serial
+
+# asynchronous actor-learner mode, pairs are then trained one after another
+NUM_ACTORS = 0      # actor processes (one SUMO each) per pair; 0 - synchronous training loop
+NUM_UPDATES = NUM_EPISODES * MAX_TIMESTEPS // TRAIN_FREQ * GRADIENT_STEPS  # as many updates as the synchronous loop
+
 # -----------------------------------------------------------------------------------------
 
 STATES = get_states_tuple(who="Mateusz")
 REWARDS = get_rewards_tuple(who="Mateusz")
 
-num_experiments = len(STATES) * len(REWARDS)
-
-for experiment_number, (state_class, reward_class) in enumerate(product(STATES, REWARDS)):
-
-    env = Environment_Traffic_Lights(state_class=state_class, reward_class=reward_class, max_steps=MAX_STEPS,
-                                    route_car_freq=ROUTE_CAR_FREQ, sumo_cfg_file=SUMO_CFG_FILE, route_file=ROUTE_FILE,
-                                    gui=GUI, yellow_duration=YELLOW_DURATION, green_duration=GREEN_DURATION)
-
-    START_TIME = int(time.time())
-
-    MODEL_DIR = Path(f'models/{env.__class__.__name__.lower()}/{START_TIME}')
-    MODEL_DIR.mkdir(parents=True, exist_ok=True)
-    (MODEL_DIR / 'checkpoints').mkdir(parents=True, exist_ok=True)
-
-    Qnet = DQN_3h(input_size=STATE_SHAPE, hidden_sizes=HIDDEN_LAYERS, output_size=NUM_ACTIONS).to(DEVICE)
-    Qtarget = DQN_3h(input_size=STATE_SHAPE, hidden_sizes=HIDDEN_LAYERS, output_size=NUM_ACTIONS).to(DEVICE)
-    Qtarget.load_state_dict(Qnet.state_dict())
-
-    optimizer = torch.optim.Adam(Qnet.parameters(), lr=OPTIMIZER_LR)
-    loss = nn.HuberLoss()
-
-    env_hiperparams = env.hiperparams()
-    learning_hiperparams = {
-        'environment': env.__class__.__name__,
-        'learning_method': 'Double Deep Q-Learning with Replay Buffer',
-        'num_episodes': NUM_EPISODES,
-        'max_timesteps': MAX_TIMESTEPS,
-        'min_buffer_lenth': MIN_BUFFER_LENGTH,
-        'max_buffer_length': MAX_BUFFER_LENGTH,
-        'train_freq': TRAIN_FREQ,
-        'batch_size': BATCH_SIZE,
-        'target_net_update_freq': TARGET_NET_UPDATE_FREQ,
-        'gamma': GAMMA,
-        'max_epsilon': MAX_EPS,
-        'min_epsilon': MIN_EPS,
-        'epsilon_decay': EPS_DECAY,
-        'device': DEVICE
-    }
-    hiperparams = {**env_hiperparams, **learning_hiperparams}
-    hiperparams['model'] = Qnet.hiperparams()
-    hiperparams['optimizer'] = {'name': optimizer.__class__.__name__, 'state_dict':optimizer.state_dict()}
-    hiperparams['loss'] = loss.__class__.__name__
-    with open(MODEL_DIR / 'hiperparams.json', 'w') as f:
-        json.dump(hiperparams, f, indent=2)
-
-    writer = SummaryWriter(log_dir=f'../runs/{env.__class__.__name__}/run{START_TIME}_experiment{experiment_number+1}', comment=f'{START_TIME}')
-
-    # -------------------------------------------------------------------------------------
-
-    replay_buffer = ReplayBuffer(MAX_BUFFER_LENGTH, device=DEVICE)
-
-    avg_episode_loss_arr = np.zeros(shape=NUM_EPISODES)
-    avg_episode_reward_arr = np.zeros(shape=NUM_EPISODES)
-
-    for episode in range(0,NUM_EPISODES):
-
-        epsilon = max(MAX_EPS - (episode)*EPS_DECAY, MIN_EPS)
-        print(f'\nEPISODE: {episode+1:3d} of {NUM_EPISODES} --> {epsilon = :.2f}      ---      experiment {experiment_number+1} of {num_experiments} --> state: {state_class.desc()}, reward: {reward_class.desc()}')
-        
-        s_t = np.array(env.reset())
-
-        episode_rewards = np.zeros(shape=MAX_TIMESTEPS)
-        episode_losses = np.zeros(shape=int(np.ceil(MAX_TIMESTEPS/TRAIN_FREQ)))
-        loss_idx = 0
-
-        for t in tqdm.trange(MAX_TIMESTEPS, position=0, leave=True):
-        
-            optimizer.zero_grad()
-
-            with torch.no_grad():
-                if np.random.rand() <= epsilon:
-                    action = np.random.choice(NUM_ACTIONS)
-                else:
-                    action = torch.argmax(Qnet(torch.Tensor(s_t).to(DEVICE)), dim=0).item()
-
-            s_t1, r_t, done, info = env.step(action)
-            s_t1 = np.array(s_t1)
-            exp_tuple = (s_t, action, r_t, s_t1, done)
-            replay_buffer.append(exp_tuple)
-
-            # if VERBOSE and t%VERBOSE_FREQ==0:
-            #     a = ACTION_LUT[action]
-            #     print(f' | {t=:4d} - {a=:>4s} - {s_t=} - {r_t=} - {Qtable[s_t]=}')
-
-            if len(replay_buffer)>MIN_BUFFER_LENGTH and t%TRAIN_FREQ==0:
-                _states, _actions, _rewards, _next_states, _dones = replay_buffer.sample(size=BATCH_SIZE)
-
-                _qvalues_all = Qnet(_states)
-                _qvalues_actions = _qvalues_all[np.arange(BATCH_SIZE), _actions]
-                
-                with torch.no_grad():
-                    _qvalues_next_all = Qtarget(_next_states)
-                    _qvalues_next_max = torch.max(_qvalues_next_all, axis=1)[0]
-                    _qvalues_next_max[_dones] = 0
-
-                    _qvalues_expected = _rewards + GAMMA * _qvalues_next_max
-                
-                _loss = loss(_qvalues_expected, _qvalues_actions)
-                _loss.backward()
-                optimizer.step()
-                
-                episode_losses[loss_idx] = _loss.detach().cpu()
-                loss_idx += 1
-            
-            if t%TARGET_NET_UPDATE_FREQ==0:
-                Qtarget.load_state_dict(Qnet.state_dict())
-
-            episode_rewards[t] = r_t
-            
-            if done:
-                s_t = np.array(env.reset())
-            else:
-                s_t = s_t1
-
-
-        avg_episode_loss = np.average(episode_losses)
-        avg_episode_loss_arr[episode] = avg_episode_loss
-
-        avg_episode_reward = np.average(episode_rewards)
-        avg_episode_reward_arr[episode] = avg_episode_reward
-
-        writer.add_scalar(tag='avg_episode_loss', scalar_value=avg_episode_loss, global_step=episode)
-        writer.add_scalar(tag='avg_reward', scalar_value=avg_episode_reward, global_step=episode)
-        writer.add_scalar(tag='epsilon', scalar_value=epsilon, global_step=episode)
-
-        if (episode+1)%QNET_CHECKPOINT_FREQ==0:
-            torch.save(Qnet.state_dict(), MODEL_DIR / 'checkpoints' / f'ep{episode+1:05d}.pt')
-
-        print(f' --- {avg_episode_loss = :.4f} -- {avg_episode_reward = :.2f}')
-
-        # if keyboard.is_pressed('ctrl+space+1'):
-        #     print(f'training interrupted after {episode+1} episode, saving...')
-        #     torch.save(Qnet.state_dict(), MODEL_DIR / 'checkpoints' / f'ep{episode+1:05d}.pt')
-        #     break
-
-    env.close()
-
-    # saving
-
-    plt.figure(figsize=(16,8.2))
-    plt.title('Average episode loss'); plt.xlabel('Episode number'); plt.ylabel('Value'), plt.grid()
-    plt.plot(avg_episode_loss_arr)
-    plt.tight_layout()
-    plt.savefig(MODEL_DIR/'avg_episode_loss.png')
-
-    plt.figure(figsize=(16,8.2))
-    plt.title('Average episode reward'); plt.xlabel('Episode number'); plt.ylabel('Value'), plt.grid()
-    plt.plot(avg_episode_reward_arr)
-    plt.tight_layout()
-    plt.savefig(MODEL_DIR/'avg_episode_reward.png')
-
-    np.save(MODEL_DIR / 'avg_episode_loss.npy', avg_episode_loss_arr)
-    np.save(MODEL_DIR / 'avg_episode_reward.npy', avg_episode_reward_arr)
-    torch.save(Qnet.state_dict(), MODEL_DIR / 'checkpoints' / 'final.pt')  # earlier Qnet only
-
-    hiperparams["learning_duration[s]"] = int(time.time()) - START_TIME
-    with open(MODEL_DIR / 'hiperparams.json', 'w') as f:
-        json.dump(hiperparams, f, indent=2)
-
-    print(f'learning duration: {hiperparams["learning_duration[s]"]} [s]')
-    # plt.show()
 
+if __name__=='__main__':
+
+    if NUM_ACTORS > 0:
+        model_dirs = [run_actor_learner(state_class, reward_class, num_actors=NUM_ACTORS, num_updates=NUM_UPDATES,
+                                        seed=seed, double=DOUBLE_DQN, max_steps=MAX_STEPS, route_car_freq=ROUTE_CAR_FREQ,
+                                        sumo_cfg_file=SUMO_CFG_FILE, route_file=ROUTE_FILE, yellow_duration=YELLOW_DURATION,
+                                        green_duration=GREEN_DURATION, max_timesteps=MAX_TIMESTEPS,
+                                        min_buffer_length=MIN_BUFFER_LENGTH, max_buffer_length=MAX_BUFFER_LENGTH,
+                                        batch_size=BATCH_SIZE, gradient_steps=GRADIENT_STEPS, hidden_layers=HIDDEN_LAYERS,
+                                        optimizer_lr=OPTIMIZER_LR, target_net_update_freq=TARGET_NET_UPDATE_FREQ // TRAIN_FREQ,
+                                        gamma=GAMMA, max_eps=MAX_EPS, min_eps=MIN_EPS, eps_decay=EPS_DECAY,
+                                        num_actions=NUM_ACTIONS, device=DEVICE)
+                      for state_class, reward_class, seed in product(STATES, REWARDS, SEEDS)]
+    else:
+        model_dirs = run_grid(STATES, REWARDS, seeds=SEEDS, max_workers=MAX_WORKERS, double=DOUBLE_DQN,
+                              max_steps=MAX_STEPS, route_car_freq=ROUTE_CAR_FREQ, sumo_cfg_file=SUMO_CFG_FILE,
+                              route_file=ROUTE_FILE, gui=GUI, yellow_duration=YELLOW_DURATION, green_duration=GREEN_DURATION,
+                              num_episodes=NUM_EPISODES, max_timesteps=MAX_TIMESTEPS, min_buffer_length=MIN_BUFFER_LENGTH,
+                              max_buffer_length=MAX_BUFFER_LENGTH, train_freq=TRAIN_FREQ, batch_size=BATCH_SIZE,
+                              gradient_steps=GRADIENT_STEPS, hidden_layers=HIDDEN_LAYERS, optimizer_lr=OPTIMIZER_LR,
+                              target_net_update_freq=TARGET_NET_UPDATE_FREQ, qnet_checkpoint_freq=QNET_CHECKPOINT_FREQ,
+                              gamma=GAMMA, max_eps=MAX_EPS, min_eps=MIN_EPS, eps_decay=EPS_DECAY,
+                              num_actions=NUM_ACTIONS, device=DEVICE)
+
+    print(*model_dirs, sep='\n')
@@ -1,6 +1,8 @@
 import numpy as np
-import itertools
+import hashlib, json, os, subprocess
+from pathlib import Path
 from typing import List, Union, Tuple
+import sumolib
 
 
 class TrafficGenerator:
@@ -16,23 +18,69 @@ class TrafficGenerator:
         else:
             self.route_car_freq = route_car_freq
 
-    def generate_route_file(self, seed:Union[None, int] = None, route_file:str = 'intersection/my_net.rou.xml'):
-        if seed is not None:
-            np.random.seed(seed)
-        
+        # departure seconds of the last route file drawn here, known without parsing it back
+        self.last_departure_steps = np.zeros(0, dtype=np.int64)
+
+    def departure_matrix(self, seed:Union[None, int] = None) -> np.ndarray:
+        """ (max_steps, num_routes) boolean matrix, True where a vehicle departs on route j at second i """
+        rng = np.random if seed is None else np.random.RandomState(seed)
+        rnds = rng.random_sample(size=(self.max_steps, len(self.routes)))
+        return rnds <= np.asarray(self.route_car_freq)
+
+    def departure_schedule(self, seed:Union[None, int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """ departure seconds and route indicies of all vehicles, sorted by departure time """
+        steps, route_idx = np.nonzero(self.departure_matrix(seed))
+        return steps, route_idx
+
+    def generate_route_definitions(self, route_file:str = 'intersection/my_net.rou.xml') -> str:
+        """ writes only the vehicle type and routes, vehicles are then injected through TraCI """
+        self._write_route_file(np.zeros((0, len(self.routes)), dtype=bool), route_file)
+        return route_file
+
+    def cache_key(self, seed:int) -> str:
+        """ content address of the route file generated for given seed """
+        key = json.dumps({'routes': self.routes, 'route_car_freq': list(self.route_car_freq),
+                          'max_steps': self.max_steps, 'seed': seed})
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def generate_route_file(self, seed:Union[None, int] = None, route_file:str = 'intersection/my_net.rou.xml',
+                            cache_dir:Union[None, str] = None) -> str:
+        """ 
+        writes the route file and returns its path \\
+        with a seed and cache_dir given, the file is stored in the cache under its content address 
+        and reused by later calls with the same demand, route_file is not touched then
+        """
+        if seed is None or cache_dir is None:
+            departures = self.departure_matrix(seed)
+            self.last_departure_steps = np.nonzero(departures.any(axis=1))[0]
+            self._write_route_file(departures, route_file)
+            return route_file
+
+        cached_file = Path(cache_dir) / f'{self.cache_key(seed)}.rou.xml'
+        if not cached_file.exists():
+            cached_file.parent.mkdir(parents=True, exist_ok=True)
+            # written aside and renamed, so concurrent workers never see a partial file
+            tmp_file = cached_file.with_suffix(f'.{os.getpid()}.tmp')
+            self._write_route_file(self.departure_matrix(seed), tmp_file)
+            os.replace(tmp_file, cached_file)
+        return str(cached_file)
+
+    def _write_route_file(self, departures:np.ndarray, route_file:Union[str, Path]):
+        lines = ['<routes> ', '<vType accel="1.0" decel="4.5" id="standard_car" length="5.0" minGap="2.5" maxSpeed="25" sigma="0.5" />']
+        lines += [f'<route id="{route_id}" edges="{self.route_edges(spawn_edge, dest_edge)}"/>' for route_id, spawn_edge, dest_edge in self.routes]
+
+        route_names = [route for route, _, _ in self.routes]
+        steps, route_idx = np.nonzero(departures)  # row-major, i.e. sorted by departure time
+        lines += [f'<vehicle id="{route_names[j]}_{i}" type="standard_car" route="{route_names[j]}" depart="{i}" departLane="random" departSpeed="10" />'
+                  for i, j in zip(steps.tolist(), route_idx.tolist())]
+        lines.append('</routes>')
+
         with open(route_file, 'w') as rf:
-            print('<routes> \n<vType accel="1.0" decel="4.5" id="standard_car" length="5.0" minGap="2.5" maxSpeed="25" sigma="0.5" />', file=rf)
-            
-            for route_id, spawn_edge, dest_edge in self.routes:
-                print(f'<route id="{route_id}" edges="{spawn_edge} {dest_edge}"/>', file=rf)
-
-            for i in range(self.max_steps):
-                rnds = np.random.random(size=len(self.routes))
-                for j,(rnd,(route,_,_)) in enumerate(zip(rnds, self.routes)):
-                    if rnd<=self.route_car_freq[j]:
-                        print(f'<vehicle id="{route}_{i}" type="standard_car" route="{route}" depart="{i}" departLane="random" departSpeed="10" />', file=rf)
-
-            print('</routes>', file=rf)
+            rf.write('\n'.join(lines) + '\n')
+
+    def route_edges(self, spawn_edge:str, dest_edge:str) -> str:
+        """ edges of a route, spawn and destination edges are adjacent in the single intersection """
+        return f'{spawn_edge} {dest_edge}'
     
     def create_route_tuple(self, start_id:int, turn:str) -> Tuple[str, str, str]:
         # returns a tuple: route_name, start_edge, destination_edge
@@ -50,6 +98,84 @@ class TrafficGenerator:
         return _name, _s_edge, _d_edge
 
 
+def generate_grid_network(grid_x:int = 3, grid_y:int = 3, grid_length:float = 200., lanes:int = 2, 
+                          network_dir:str = 'intersection/grid') -> Tuple[str, str]:
+    """ 
+    builds a grid_x by grid_y grid of signalised junctions with netgenerate (an edge leading in and out 
+    of the grid is attached to every border junction), returns (net_file, sumo_cfg_file) \\
+    files already present in network_dir are reused
+    """
+    network_dir = Path(network_dir)
+    network_dir.mkdir(parents=True, exist_ok=True)
+    name = f'grid_{grid_x}x{grid_y}_l{grid_length:g}_n{lanes}'
+    net_file = network_dir / f'{name}.net.xml'
+    cfg_file = network_dir / f'{name}.sumocfg'
+
+    if not net_file.exists():
+        # netgenerate names junctions by column letter and row number: A0, A1, ..., B0, ...
+        junctions = [f'{chr(ord("A") + x)}{y}' for x in range(grid_x) for y in range(grid_y)]
+        tmp_file = net_file.with_suffix(f'.{os.getpid()}.tmp')
+        subprocess.run([sumolib.checkBinary('netgenerate'), '--grid', 
+                        '--grid.x-number', str(grid_x), '--grid.y-number', str(grid_y),
+                        '--grid.length', str(grid_length), '--grid.attach-length', str(grid_length),
+                        '--default.lanenumber', str(lanes), '--turn-lanes', '1',
+                        '--tls.set', ','.join(junctions), '--no-turnarounds', 'true',
+                        '-o', str(tmp_file)], check=True, capture_output=True)
+        os.replace(tmp_file, net_file)
+
+    if not cfg_file.exists():
+        cfg_file.write_text('<?xml version="1.0" encoding="UTF-8"?>\n\n'
+                            '<configuration>\n'
+                            f'    <input>\n        <net-file value="{net_file.name}"/>\n    </input>\n'
+                            '    <time>\n        <begin value="0"/>\n    </time>\n'
+                            '    <report>\n        <verbose value="true"/>\n        <no-step-log value="true"/>\n    </report>\n'
+                            '</configuration>\n')
+
+    return str(net_file), str(cfg_file)
+
+
+class GridTrafficGenerator(TrafficGenerator):
+    """ 
+    demand for generated grids: one route from every border entry to every other border exit, 
+    following the shortest path through the grid \\
+    without route_car_freq, each entry spawns entry_freq vehicles per second spread evenly over its routes
+    """
+    def __init__(self, net_file:str, max_steps:int, route_car_freq:Union[None, List[float]] = None, 
+                 entry_freq:float = 0.05):
+        self.max_steps = max_steps
+        self.net_file = str(net_file)
+
+        net = sumolib.net.readNet(self.net_file)
+        # border edges: entries have no predecessors, exits no successors (there are no turnarounds)
+        entries = sorted((edge for edge in net.getEdges() if not edge.getIncoming()), key=lambda edge: edge.getID())
+        exits = sorted((edge for edge in net.getEdges() if not edge.getOutgoing()), key=lambda edge: edge.getID())
+
+        self.routes = []
+        self._paths = {}
+        for entry in entries:
+            for exit in exits:
+                if exit.getToNode() is entry.getFromNode():
+                    continue
+                path, _ = net.getShortestPath(entry, exit)
+                self.routes.append((f'{entry.getFromNode().getID()}_{exit.getToNode().getID()}', entry.getID(), exit.getID()))
+                self._paths[(entry.getID(), exit.getID())] = ' '.join(edge.getID() for edge in path)
+
+        if route_car_freq is None:
+            self.route_car_freq = [entry_freq / (len(exits) - 1) for _ in self.routes]
+        else:
+            self.route_car_freq = route_car_freq
+
+        self.last_departure_steps = np.zeros(0, dtype=np.int64)
+
+    def route_edges(self, spawn_edge:str, dest_edge:str) -> str:
+        return self._paths[(spawn_edge, dest_edge)]
+
+    def cache_key(self, seed:int) -> str:
+        key = json.dumps({'net_file': Path(self.net_file).name, 'routes': self.routes, 
+                          'route_car_freq': list(self.route_car_freq), 'max_steps': self.max_steps, 'seed': seed})
+        return hashlib.sha1(key.encode()).hexdigest()
+
+
 
 if __name__=='__main__':
     gen = TrafficGenerator(10)
@@ -0,0 +1,32 @@
+import os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from pathlib import Path
+from typing import Iterable, List, Union
+
+from experiment import run_experiment
+from vector_env import worker_route_file
+
+
+def run_grid(states: Iterable, rewards: Iterable, seeds: Iterable = (None,), max_workers: Union[None, int] = None,
+             route_file: str = 'intersection/my_net.rou.xml', **experiment_kwargs) -> List[Path]:
+    """
+    trains every (state_class, reward_class, seed) combination, each in its own process with its own SUMO,
+    at most max_workers at a time (all cores by default, max_workers=1 runs serially in this process) \\
+    returns model directories in the order of combinations
+    """
+    jobs = list(product(states, rewards, seeds))
+    num_experiments = len(jobs)
+    max_workers = min(max_workers or os.cpu_count(), num_experiments)
+
+    if max_workers == 1:
+        return [run_experiment(state_class, reward_class, experiment_number, num_experiments, seed,
+                               route_file=route_file, **experiment_kwargs)
+                for experiment_number, (state_class, reward_class, seed) in enumerate(jobs)]
+
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp.get_context('spawn')) as pool:
+        futures = [pool.submit(run_experiment, state_class, reward_class, experiment_number, num_experiments, seed,
+                               route_file=worker_route_file(route_file, experiment_number), **experiment_kwargs)
+                   for experiment_number, (state_class, reward_class, seed) in enumerate(jobs)]
+        return [future.result() for future in futures]
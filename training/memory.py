@@ -1,6 +1,8 @@
 import numpy as np
-import collections
+import time
 import torch
+import multiprocessing as mp
+from multiprocessing import shared_memory
 from typing import Tuple, List, Union
 
 
@@ -9,11 +11,19 @@ ExpTuple = Tuple[ List[int], int, Union[int,float], List[int], bool ]
 
 
 class ReplayBuffer:
+    """
+    circular experience buffer stored as preallocated arrays, one per experience tuple field \\
+    storage is allocated on the first append, when the state shape is known
+    """
     
     def __init__(self, max_length:int, device:Union[None, str]=None):
         self._max_length = max_length
         
-        self._memory = collections.deque(maxlen=max_length)
+        self._states = None
+        self._actions = None
+        self._rewards = None
+        self._next_states = None
+        self._dones = None
         self._tail_offset = 0
         self._full = False
 
@@ -24,45 +34,77 @@ class ReplayBuffer:
         else:
             self._torch = False
 
+    def _allocate(self, state:List[int]):
+        state_shape = np.shape(state)
+        self._states = np.zeros((self._max_length, *state_shape), dtype=np.float32)
+        self._actions = np.zeros(self._max_length, dtype=np.int64)
+        self._rewards = np.zeros(self._max_length, dtype=np.float32)
+        self._next_states = np.zeros((self._max_length, *state_shape), dtype=np.float32)
+        self._dones = np.zeros(self._max_length, dtype=bool)
+
     def append(self, experience_tuple:ExpTuple):
-        if self._full:
-            self._memory[self._tail_offset] = experience_tuple
-            self._tail_offset += 1
-            if self._tail_offset == self._max_length:
-                self._tail_offset = 0
-        else:
-            self._memory.append(experience_tuple)
-            self._tail_offset += 1
-            if self._tail_offset == self._max_length:
-                self._full = True
-                self._tail_offset = 0
+        state, action, reward, next_state, done = experience_tuple
+        if self._states is None:
+            self._allocate(state)
+
+        idx = self._tail_offset
+        self._states[idx] = state
+        self._actions[idx] = action
+        self._rewards[idx] = reward
+        self._next_states[idx] = next_state
+        self._dones[idx] = done
+
+        self._tail_offset += 1
+        if self._tail_offset == self._max_length:
+            self._full = True
+            self._tail_offset = 0
+
+    def extend(self, states:np.ndarray, actions:np.ndarray, rewards:np.ndarray, next_states:np.ndarray, dones:np.ndarray) -> np.ndarray:
+        """ appends a batch of experiences (at most max_length) in one vectorized write, returns their indicies """
+        if self._states is None:
+            self._allocate(states[0])
+
+        indicies = (self._tail_offset + np.arange(len(actions))) % self._max_length
+        self._states[indicies] = states
+        self._actions[indicies] = actions
+        self._rewards[indicies] = rewards
+        self._next_states[indicies] = next_states
+        self._dones[indicies] = dones
+
+        self._tail_offset += len(actions)
+        if self._tail_offset >= self._max_length:
+            self._full = True
+            self._tail_offset %= self._max_length
+        return indicies
 
     def sample(self, size:int) -> Tuple[np.ndarray]:
+        if not len(self):
+            raise ValueError('cannot sample from an empty buffer')
         size = min(size, len(self))
-        indicies = np.random.choice(len(self), size=size)
-        samples = [self._memory[idx] for idx in indicies]
-        return self._vectorize(samples)
+        indicies = np.random.randint(len(self), size=size)
+        return self._vectorize(indicies)
     
-    def _vectorize(self, samples:List[ExpTuple]) -> Tuple[np.ndarray]:
-        states, actions, rewards, next_states, dones = [], [], [], [], []
-        for sample in samples:
-            states.append(sample[0])
-            actions.append(sample[1])
-            rewards.append(sample[2])
-            next_states.append(sample[3])
-            dones.append(sample[4])
+    def _vectorize(self, indicies:np.ndarray) -> Tuple[np.ndarray]:
+        # fancy indexing already yields fresh contiguous arrays, torch can share their memory
+        batch = (self._states[indicies], self._actions[indicies], self._rewards[indicies],
+                 self._next_states[indicies], self._dones[indicies])
         if not self._torch:
-            return np.array(states), np.array(actions), np.array(rewards), np.array(next_states), np.array(dones)
+            return batch
         else:
-            states = torch.FloatTensor(np.array(states, copy=False, dtype=np.float64)).to(self._device)
-            actions = torch.LongTensor(np.array(actions, copy=False, dtype=np.int64)).to(self._device)
-            rewards = torch.FloatTensor(np.array(rewards, copy=False, dtype=np.float64)).to(self._device)
-            next_states = torch.FloatTensor(np.array(next_states, copy=False, dtype=np.float64)).to(self._device)
-            dones = torch.BoolTensor(np.array(dones, copy=False, dtype=bool)).to(self._device)
-            return states, actions, rewards, next_states, dones
+            return tuple(torch.from_numpy(array).to(self._device) for array in batch)
 
     def __getitem__(self, idx:int) -> ExpTuple:
-        return self._memory[idx]
+        return self._states[idx], self._actions[idx], self._rewards[idx], self._next_states[idx], self._dones[idx]
+
+    def load_dataset(self, dataset, state_class=None, reward_class=None, chunk_size:int=4096) -> int:
+        """ 
+        warm start: appends the last max_length transitions of an ExperienceDataset, streamed in chunks, 
+        with state_class / reward_class given they are recomputed from the recorded lane features, returns the number loaded
+        """
+        start = max(len(dataset) - self._max_length, 0)
+        for chunk in dataset.chunks(chunk_size, state_class, reward_class, start=start):
+            self.extend(*chunk)
+        return len(dataset) - start
 
     def __len__(self) -> int:
         if self._full:
@@ -71,9 +113,271 @@ class ReplayBuffer:
             return self._tail_offset
 
 
-class MemoryPalace:
-    # TODO: implement :)
-    pass
+class SegmentTree:
+    """
+    binary tree over max_length leaves kept in a flat array (root at index 1), \\
+    every inner node holds ``operation`` of its children, batched updates touch O(batch * log n) nodes
+    """
+
+    def __init__(self, max_length:int, operation:np.ufunc, neutral:float):
+        self._capacity = 1
+        while self._capacity < max_length:
+            self._capacity *= 2
+        self._operation = operation
+        self._tree = np.full(2 * self._capacity, neutral, dtype=np.float64)
+
+    def update(self, indicies:np.ndarray, values:Union[float, np.ndarray]):
+        nodes = np.asarray(indicies, dtype=np.int64) + self._capacity
+        self._tree[nodes] = values
+        # all nodes are on one level, with a single leaf it is the root already
+        while nodes[0] > 1:
+            nodes = np.unique(nodes // 2)
+            self._tree[nodes] = self._operation(self._tree[2 * nodes], self._tree[2 * nodes + 1])
+
+    def root(self) -> float:
+        return self._tree[1]
+
+    def __getitem__(self, indicies:np.ndarray) -> np.ndarray:
+        return self._tree[np.asarray(indicies, dtype=np.int64) + self._capacity]
+
+
+class SumTree(SegmentTree):
+
+    def __init__(self, max_length:int):
+        super().__init__(max_length, np.add, 0.)
+
+    def find_prefixsum_idx(self, prefixsums:np.ndarray) -> np.ndarray:
+        """ for every value returns the leaf at which the running sum of priorities exceeds it """
+        prefixsums = np.array(prefixsums, dtype=np.float64)
+        nodes = np.ones(len(prefixsums), dtype=np.int64)
+        while nodes[0] < self._capacity:
+            left = 2 * nodes
+            go_right = prefixsums > self._tree[left]
+            prefixsums = np.where(go_right, prefixsums - self._tree[left], prefixsums)
+            nodes = left + go_right
+        return nodes - self._capacity
+
+
+class MinTree(SegmentTree):
+
+    def __init__(self, max_length:int):
+        super().__init__(max_length, np.minimum, np.inf)
+
+
+class MemoryPalace(ReplayBuffer):
+    """
+    prioritized experience replay (proportional variant) \\
+    experiences are sampled with probability p_i^alpha / sum_k p_k^alpha, where p_i = |td_error_i| + eps, \\
+    sample() additionally returns importance-sampling weights and the sampled indicies, 
+    which should be passed back to update_priorities() with the new td errors
+    """
+
+    def __init__(self, max_length:int, device:Union[None, str]=None, 
+                 alpha:float=0.6, beta:float=0.4, eps:float=1e-6):
+        super().__init__(max_length, device)
+        self._alpha = alpha
+        self._beta = beta
+        self._eps = eps
+
+        self._sum_tree = SumTree(max_length)
+        self._min_tree = MinTree(max_length)
+        self._max_priority = 1.
+
+    def append(self, experience_tuple:ExpTuple):
+        idx = self._tail_offset
+        super().append(experience_tuple)
+        # new experiences get the highest priority seen so far, so each is replayed at least once
+        self._set_priorities([idx], self._max_priority ** self._alpha)
+
+    def extend(self, states:np.ndarray, actions:np.ndarray, rewards:np.ndarray, next_states:np.ndarray, dones:np.ndarray) -> np.ndarray:
+        indicies = super().extend(states, actions, rewards, next_states, dones)
+        self._set_priorities(indicies, self._max_priority ** self._alpha)
+        return indicies
+
+    def sample(self, size:int, beta:Union[None, float]=None) -> Tuple[np.ndarray]:
+        if not len(self):
+            raise ValueError('cannot sample from an empty buffer')
+        size = min(size, len(self))
+        beta = self._beta if beta is None else beta
+
+        # stratified sampling: one value from each of size equal priority segments
+        total = self._sum_tree.root()
+        prefixsums = (np.arange(size) + np.random.random(size)) * (total / size)
+        indicies = np.minimum(self._sum_tree.find_prefixsum_idx(prefixsums), len(self) - 1)
+
+        # weights normalized by the largest possible one, w_max = (N * p_min)^-beta
+        probabilities = self._sum_tree[indicies] / total
+        min_probability = self._min_tree.root() / total
+        weights = ((probabilities / min_probability) ** -beta).astype(np.float32)
+
+        batch = self._vectorize(indicies)
+        if self._torch:
+            weights = torch.from_numpy(weights).to(self._device)
+        return (*batch, weights, indicies)
+
+    def update_priorities(self, indicies:np.ndarray, td_errors:Union[np.ndarray, torch.Tensor]):
+        if isinstance(td_errors, torch.Tensor):
+            td_errors = td_errors.detach().cpu().numpy()
+        priorities = np.abs(td_errors).astype(np.float64) + self._eps
+        self._max_priority = max(self._max_priority, priorities.max())
+        self._set_priorities(indicies, priorities ** self._alpha)
+
+    def _set_priorities(self, indicies:np.ndarray, priorities:Union[float, np.ndarray]):
+        self._sum_tree.update(indicies, priorities)
+        self._min_tree.update(indicies, priorities)
+
+
+class SharedReplayBuffer(ReplayBuffer):
+    """
+    ReplayBuffer stored in multiprocessing.shared_memory segments, so writer processes append straight into 
+    the arrays a learner process samples from, no experience is pickled on the way \\
+    writers only lock to reserve and commit slots, the data is written outside the lock; slots can be committed 
+    out of order, so only the contiguous committed prefix (the written watermark) is sampled, minus slots already 
+    reserved again for overwriting, and samples overwritten while being copied are drawn again; 
+    writers never lap a slot that is still being written \\
+    the buffer is passed to other processes as an argument, they attach to the same segments by name; 
+    the creating process should call unlink() once all of them are done
+    """
+
+    _FIELDS = ('_states', '_actions', '_rewards', '_next_states', '_dones', '_positions')
+
+    def __init__(self, max_length:int, state_shape:Tuple[int, ...], device:Union[None, str]=None):
+        super().__init__(max_length, device)
+        self._state_shape = tuple(state_shape)
+        self._lock = mp.get_context('spawn').Lock()
+        # slots reserved by writers so far (used as a ring index), experiences completely written 
+        # and the written watermark: all reserved positions below it are committed
+        self._counters_shm = shared_memory.SharedMemory(create=True, size=3 * np.dtype(np.int64).itemsize)
+        self._segments = {field: shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+                          for field, (shape, dtype) in self._layout().items()}
+        self._owner = True
+        self._attach()
+        self._counters[:] = 0
+        self._positions[:] = -1
+
+    def _layout(self) -> dict:
+        # _positions: absolute (not wrapped) position committed to each slot
+        shapes = ((self._max_length, *self._state_shape), (self._max_length,), (self._max_length,),
+                  (self._max_length, *self._state_shape), (self._max_length,), (self._max_length,))
+        dtypes = (np.float32, np.int64, np.float32, np.float32, bool, np.int64)
+        return dict(zip(self._FIELDS, zip(shapes, dtypes)))
+
+    def _attach(self):
+        self._counters = np.ndarray(3, dtype=np.int64, buffer=self._counters_shm.buf)
+        for field, (shape, dtype) in self._layout().items():
+            setattr(self, field, np.ndarray(shape, dtype=dtype, buffer=self._segments[field].buf))
+
+    def __getstate__(self) -> dict:
+        state = {k: v for k, v in self.__dict__.items() if k not in (*self._FIELDS, '_counters')}
+        state['_counters_shm'] = self._counters_shm.name
+        state['_segments'] = {field: segment.name for field, segment in self._segments.items()}
+        state['_owner'] = False
+        return state
+
+    def __setstate__(self, state:dict):
+        self.__dict__.update(state)
+        self._counters_shm = shared_memory.SharedMemory(name=state['_counters_shm'])
+        self._segments = {field: shared_memory.SharedMemory(name=name) for field, name in state['_segments'].items()}
+        self._attach()
+
+    def _reserve(self, size:int) -> np.ndarray:
+        """ 
+        absolute positions of size new slots, waits while they would lap a slot still being written 
+        (a stalled writer could otherwise clobber a newer experience)
+        """
+        if size > self._max_length:
+            raise ValueError(f'cannot write {size} experiences at once into a buffer of {self._max_length}')
+        while True:
+            with self._lock:
+                start = int(self._counters[0])
+                if start + size - int(self._counters[2]) <= self._max_length:
+                    self._counters[0] = start + size
+                    return start + np.arange(size)
+            time.sleep(1e-4)
+
+    def _commit(self, positions:np.ndarray):
+        with self._lock:
+            self._positions[positions % self._max_length] = positions
+            self._counters[1] += len(positions)
+            # the watermark moves over the committed run following it
+            watermark, reserved = int(self._counters[2]), int(self._counters[0])
+            pending = watermark + np.arange(reserved - watermark)
+            uncommitted = np.flatnonzero(self._positions[pending % self._max_length] != pending)
+            self._counters[2] = pending[uncommitted[0]] if len(uncommitted) else reserved
+
+    def append(self, experience_tuple:ExpTuple):
+        positions = self._reserve(1)
+        idx = positions[0] % self._max_length
+        state, action, reward, next_state, done = experience_tuple
+        self._states[idx] = state
+        self._actions[idx] = action
+        self._rewards[idx] = reward
+        self._next_states[idx] = next_state
+        self._dones[idx] = done
+        self._commit(positions)
+
+    def extend(self, states:np.ndarray, actions:np.ndarray, rewards:np.ndarray, next_states:np.ndarray, dones:np.ndarray) -> np.ndarray:
+        positions = self._reserve(len(actions))
+        indicies = positions % self._max_length
+        self._states[indicies] = states
+        self._actions[indicies] = actions
+        self._rewards[indicies] = rewards
+        self._next_states[indicies] = next_states
+        self._dones[indicies] = dones
+        self._commit(positions)
+        return indicies
+
+    def _valid_range(self) -> Tuple[int, int]:
+        """ absolute positions [low, high) written and not reserved again """
+        with self._lock:
+            reserved, watermark = int(self._counters[0]), int(self._counters[2])
+        return max(0, reserved - self._max_length), watermark
+
+    def sample(self, size:int) -> Tuple[np.ndarray]:
+        low, high = self._valid_range()
+        size = min(size, max(high - low, 0))
+        positions = np.random.randint(low, max(high, low + 1), size=size)
+        batch = [array[positions % self._max_length] for array in (self._states, self._actions, self._rewards, 
+                                                                   self._next_states, self._dones)]
+        while True:
+            # slots reserved again meanwhile may have been overwritten during the copy
+            low, high = self._valid_range()
+            stale = np.flatnonzero(positions < low)
+            if not len(stale):
+                break
+            if high <= low:
+                # nothing valid left to draw from, stale samples are dropped
+                positions = np.delete(positions, stale)
+                batch = [np.delete(array, stale, axis=0) for array in batch]
+                break
+            positions[stale] = np.random.randint(low, high, size=len(stale))
+            for array, values in zip(batch, (self._states, self._actions, self._rewards, self._next_states, self._dones)):
+                array[stale] = values[positions[stale] % self._max_length]
+        if not self._torch:
+            return tuple(batch)
+        return tuple(torch.from_numpy(array).to(self._device) for array in batch)
+
+    def num_appended(self) -> int:
+        """ experiences written since the buffer was created, including overwritten ones """
+        return int(self._counters[1])
+
+    def __len__(self) -> int:
+        low, high = self._valid_range()
+        return max(high - low, 0)
+
+    def close(self):
+        """ detaches this process from the shared segments """
+        for field in (*self._FIELDS, '_counters'):
+            setattr(self, field, None)
+        for segment in (self._counters_shm, *self._segments.values()):
+            segment.close()
+
+    def unlink(self):
+        """ detaches and frees the shared segments, called by the creating process """
+        self.close()
+        if self._owner:
+            for segment in (self._counters_shm, *self._segments.values()):
+                segment.unlink()
 
 
 
@@ -84,4 +388,4 @@ if __name__=='__main__':
     for i in range(9):
         et = ([i],i,i,i,True)
         rb.append(et)
-        print(rb._tail_offset, rb._memory, len(rb), rb[i%4])
\ No newline at end of file
+        print(rb._tail_offset, rb._states.ravel(), len(rb), rb[i%4])
\ No newline at end of file
@@ -0,0 +1,81 @@
+import argparse, json
+import numpy as np
+from pathlib import Path
+from typing import List, Union
+
+
+class NumpyPolicy:
+    """
+    torch-free greedy policy for exported DQN_1h / DQN_3h checkpoints \\
+    same observe/act interface as agent_testing.Agent, the forward pass is a chain of matmuls with ReLUs
+    """
+
+    def __init__(self, weights_file: Union[str, Path]):
+        with np.load(weights_file) as npz:
+            num_layers = int(npz['num_layers'])
+            self._weights = [np.ascontiguousarray(npz[f'W{k}'].T) for k in range(num_layers)]
+            self._biases = [npz[f'b{k}'] for k in range(num_layers)]
+            self._hp = json.loads(str(npz['hiperparams']))
+
+        self._observed_state = None
+
+    def observe(self, state):
+        self._observed_state = state
+
+    def act(self) -> int:
+        return int(np.argmax(self.qvalues(self._observed_state)))
+
+    def act_batch(self, states: np.ndarray) -> np.ndarray:
+        return np.argmax(self.qvalues(states), axis=-1)
+
+    def qvalues(self, states: np.ndarray) -> np.ndarray:
+        x = np.asarray(states, dtype=np.float32)
+        for W, b in zip(self._weights[:-1], self._biases[:-1]):
+            x = np.maximum(x @ W + b, 0)
+        return x @ self._weights[-1] + self._biases[-1]
+
+    def hiperparams(self) -> dict:
+        return self._hp
+
+
+def export_checkpoint(model_dir: Union[str, Path], out_file: Union[None, str, Path] = None,
+                      checkpoint_file: Union[None, str, Path] = None) -> Path:
+    """ converts a checkpoint (the last one by default) into <model_dir>/policy.npz, returns the written file """
+    import torch
+
+    model_dir = Path(model_dir)
+    if checkpoint_file is None:
+        # same choice as agent_testing.last_checkpoint_file
+        checkpoint_file = model_dir / 'checkpoints' / 'final.pt'
+        if not checkpoint_file.exists():
+            checkpoint_file = sorted((model_dir / 'checkpoints').iterdir())[-1]
+    if out_file is None:
+        out_file = model_dir / 'policy.npz'
+
+    with open(model_dir / 'hiperparams.json') as hpf:
+        hp = json.load(hpf)
+
+    state_dict = torch.load(checkpoint_file, map_location='cpu')
+    # linear layers are seq.<index>.weight / seq.<index>.bias, ReLUs in between hold no parameters
+    layer_ids : List[int] = sorted({int(name.split('.')[1]) for name in state_dict if name.endswith('.weight')})
+
+    arrays = {}
+    for k, layer_id in enumerate(layer_ids):
+        arrays[f'W{k}'] = state_dict[f'seq.{layer_id}.weight'].numpy().astype(np.float32)
+        arrays[f'b{k}'] = state_dict[f'seq.{layer_id}.bias'].numpy().astype(np.float32)
+
+    meta = {'model_dir': str(model_dir), 'checkpoint': Path(checkpoint_file).name,
+            'state_class': hp.get('state_class'), 'reward_class': hp.get('reward_class'), 'model': hp.get('model')}
+    np.savez(out_file, num_layers=len(layer_ids), hiperparams=json.dumps(meta), **arrays)
+    return Path(out_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='export a trained agent to a torch-free .npz policy')
+    parser.add_argument('model_dir', help='e.g. models/environment_traffic_lights/1638899442')
+    parser.add_argument('-o', '--out', default=None, help='output file, <model_dir>/policy.npz by default')
+    parser.add_argument('-c', '--checkpoint', default=None, help='checkpoint file, the last one by default')
+    args = parser.parse_args()
+
+    out_file = export_checkpoint(args.model_dir, args.out, args.checkpoint)
+    print(f'exported policy: {out_file}')
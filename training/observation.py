@@ -0,0 +1,102 @@
+import numpy as np
+import traci
+import traci.constants as tc
+from typing import List, Set, Union
+
+
+class LaneObserver:
+    """
+    Shared per-lane observation cache built on TraCI lane subscriptions.
+
+    Every lane is subscribed once after the simulation is (re)loaded, so all variables
+    arrive together with the ``simulationStep`` response. States, rewards and metrics
+    read from the cached snapshot instead of issuing one ``traci.lane.get*`` call per lane.
+    """
+
+    # feature name -> subscribed TraCI variable
+    FEATURES = {
+        'halting': tc.LAST_STEP_VEHICLE_HALTING_NUMBER,
+        'count': tc.LAST_STEP_VEHICLE_NUMBER,
+        'waiting': tc.VAR_WAITING_TIME,
+        'speed': tc.LAST_STEP_MEAN_SPEED,
+    }
+    # feature name -> column of the snapshot (and of recorded feature arrays)
+    COLUMNS = {name: j for j, name in enumerate(FEATURES)}
+
+    def __init__(self, sim=traci):
+        self.sim = sim
+        self.lanes = list(sim.lane.getIDList())
+        self.incoming = [lane for lane in self.lanes if 'i' in lane]
+
+        self._lane_index = {lane: i for i, lane in enumerate(self.lanes)}
+        self._columns = self.COLUMNS
+        self._variables = list(self.FEATURES.values())
+        # float32, like the states fed to the networks and the recorded lane features
+        self._values = np.zeros((len(self.lanes), len(self.FEATURES)), dtype=np.float32)
+
+        # only lanes requested by some consumer are subscribed
+        self._tracked : List[str] = []
+        # lanes whose vehicle ids are subscribed as well, ids from the last step
+        self._vehicle_lanes : Set[str] = set()
+        self._vehicle_ids = {}
+
+    def _subscribe(self, lane: str):
+        if lane in self._vehicle_lanes:
+            self.sim.lane.subscribe(lane, self._variables + [tc.LAST_STEP_VEHICLE_ID_LIST])
+        else:
+            self.sim.lane.subscribe(lane, self._variables)
+
+    def subscribe(self):
+        """ (re)subscribes tracked lanes, needed after every ``traci.load`` """
+        for lane in self._tracked:
+            self._subscribe(lane)
+        self.update()
+
+    def update(self):
+        """ refreshes the snapshot from the results delivered with the last simulation step """
+        results = self.sim.lane.getAllSubscriptionResults()
+        for lane in self._tracked:
+            values = results.get(lane)
+            if values:
+                self._values[self._lane_index[lane]] = [values[variable] for variable in self._variables]
+        for lane in self._vehicle_lanes:
+            values = results.get(lane)
+            self._vehicle_ids[lane] = values[tc.LAST_STEP_VEHICLE_ID_LIST] if values else ()
+
+    def indices(self, lanes: List[str]) -> np.ndarray:
+        """ starts tracking given lanes and returns their rows in the snapshot """
+        new_lanes = [lane for lane in lanes if lane not in self._tracked]
+        for lane in new_lanes:
+            self._subscribe(lane)
+        self._tracked.extend(new_lanes)
+        if new_lanes:
+            self.update()
+        return np.array([self._lane_index[lane] for lane in lanes], dtype=np.int64)
+
+    def track_vehicles(self, lanes: List[str]):
+        """ adds ids of vehicles on given lanes to their subscription, see ``vehicles`` """
+        self.indices(lanes)
+        new_lanes = [lane for lane in lanes if lane not in self._vehicle_lanes]
+        self._vehicle_lanes.update(new_lanes)
+        for lane in new_lanes:
+            self._subscribe(lane)
+        if new_lanes:
+            self.update()
+
+    def vehicles(self, lanes: Union[None, List[str]] = None) -> Set[str]:
+        """ ids of vehicles on given lanes (all lanes passed to ``track_vehicles`` by default) """
+        lanes = self._vehicle_lanes if lanes is None else lanes
+        return set().union(*(self._vehicle_ids[lane] for lane in lanes))
+
+    def get(self, feature: str, indices: Union[None, np.ndarray] = None) -> np.ndarray:
+        """ returns a copy of the feature values for given lane indices (all lanes by default) """
+        column = self._values[:, self._columns[feature]]
+        return column.copy() if indices is None else column[indices]
+
+    def features(self, indices: Union[None, np.ndarray] = None) -> np.ndarray:
+        """ returns a copy of all feature values (lanes x features) for given lane indices (all lanes by default) """
+        return self._values.copy() if indices is None else self._values[indices]
+
+    def values(self) -> np.ndarray:
+        """ the snapshot itself (lanes x features, COLUMNS order), not a copy - read, do not modify """
+        return self._values
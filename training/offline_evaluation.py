@@ -0,0 +1,88 @@
+from pathlib import Path
+from typing import Union
+import pandas as pd
+import tqdm
+
+from traffic_envs import Environment_Traffic_Lights
+from dataset import ExperienceRecorder, ExperienceDataset
+from states import QueueState, get_states_tuple
+from rewards import NegQueueReward, get_rewards_tuple, get_metrics_tuple
+
+
+def record_trajectory(agent, path: Union[str, Path], env_params: dict, timesteps: int = 1000,
+                      verbose: bool = False) -> ExperienceDataset:
+    """
+    one simulation pass of a fixed agent (observe/act interface of baseline and trained agents),
+    recording every lane feature and the throughput, so any State and Reward can be evaluated from it \\
+    env_params are Environment_Traffic_Lights parameters, its state_class should be the one the agent observes \\
+    an existing dataset at path is appended to
+    """
+    env = Environment_Traffic_Lights(**{"reward_class": NegQueueReward, **env_params, "max_steps": timesteps})
+    recorder = ExperienceRecorder(path, env.observer(), capacity=timesteps, hiperparams=env.hiperparams(), throughput=True)
+
+    s_t = env.reset()
+    recorder.start()
+    for _ in tqdm.trange(timesteps, leave=True, position=0, disable=not verbose):
+        agent.observe(s_t)
+        action = agent.act()
+        s_t1, r_t, done, _ = env.step(action)
+        recorder.append((s_t, action, r_t, s_t1, done), env.sim_time())
+        if done:
+            s_t1 = env.reset()
+            recorder.start()
+        s_t = s_t1
+
+    recorder.close()
+    env.close()
+    return ExperienceDataset(path)
+
+
+def reward_values(dataset: ExperienceDataset, reward_classes: list) -> pd.DataFrame:
+    """ per-step values of every reward (or metric) class, computed over the whole recorded array at once """
+    return pd.DataFrame({reward_class.__name__: dataset.rewards(reward_class) for reward_class in reward_classes})
+
+
+def reward_summary(dataset: ExperienceDataset, reward_classes: Union[None, list] = None) -> pd.DataFrame:
+    """
+    one row per reward class of the recorded trajectory: mean, std and total reward,
+    in place of one simulation per class
+    """
+    reward_classes = get_rewards_tuple("Wojtek") + get_rewards_tuple("Mateusz") if reward_classes is None else reward_classes
+    rewards = reward_values(dataset, reward_classes)
+    summary = pd.DataFrame({"reward (mean)": rewards.mean(), "reward (std)": rewards.std(), "reward (total)": rewards.sum()})
+    return summary.rename_axis("reward_class").reset_index()
+
+
+def state_summary(dataset: ExperienceDataset, state_classes: Union[None, list] = None) -> pd.DataFrame:
+    """ one row per state class of the recorded trajectory: state size, mean, std, min and max of its values """
+    state_classes = get_states_tuple() if state_classes is None else state_classes
+    records = []
+    for state_class in state_classes:
+        states = dataset.states(state_class)
+        records.append([state_class.__name__, states.shape[-1], float(states.mean()), float(states.std()),
+                        float(states.min()), float(states.max())])
+    columns = ["state_class", "state size", "state (mean)", "state (std)", "state (min)", "state (max)"]
+    return pd.DataFrame.from_records(records, columns=columns)
+
+
+if __name__=='__main__':
+
+    import shutil
+    from baseline_agent import Alternating_Phases
+
+    env_params = {
+        "route_car_freq": [0.02, 0.05, 0.01]*4,
+        "yellow_duration": 4,
+        "green_duration": 4,
+        "state_class": QueueState,
+        "seed": 0
+    }
+
+    TRAJECTORY_DIR = Path('models/environment_traffic_lights/baseline_trajectory')
+    shutil.rmtree(TRAJECTORY_DIR, ignore_errors=True)
+
+    dataset = record_trajectory(Alternating_Phases([7, 3, 7, 3]), TRAJECTORY_DIR, env_params, timesteps=1000, verbose=True)
+
+    print(state_summary(dataset))
+    print(reward_summary(dataset))
+    print(reward_values(dataset, get_metrics_tuple()).describe())
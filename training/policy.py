@@ -0,0 +1,47 @@
+import numpy as np
+import torch
+import torch.nn as nn
+from typing import Union
+
+
+class GreedyPolicy:
+    """
+    greedy (argmax Q) action selection for a Q-network
+        - observations are copied into a preallocated float32 buffer, no tensor is created per step
+        - forward passes run in torch.inference_mode
+        - act(state) -> int, act_batch(states) -> np.ndarray of ints, one row per environment
+    """
+
+    def __init__(self, model: nn.Module, device: Union[str, torch.device] = 'cpu'):
+        self._model = model
+        self._device = torch.device(device)
+        self._buffer : Union[None, torch.Tensor] = None
+        self._buffer_np : Union[None, np.ndarray] = None
+
+    def _allocate(self, batch_size: int, state_size: int):
+        # cpu tensor sharing memory with a numpy view, filled in place
+        self._buffer = torch.zeros((batch_size, state_size), dtype=torch.float32)
+        if self._device.type == 'cuda':
+            self._buffer = self._buffer.pin_memory()
+        self._buffer_np = self._buffer.numpy()
+
+    def act_batch(self, states: np.ndarray) -> np.ndarray:
+        states = np.asarray(states)
+        batch_size = states.shape[0]
+        if self._buffer is None or self._buffer.shape[0] < batch_size or self._buffer.shape[1] != states.shape[1]:
+            self._allocate(batch_size, states.shape[1])
+
+        self._buffer_np[:batch_size] = states
+        with torch.inference_mode():
+            return self._forward(batch_size).argmax(dim=1).cpu().numpy()
+
+    def act(self, state: np.ndarray) -> int:
+        if self._buffer is None or self._buffer.shape[1] != len(state):
+            self._allocate(1, len(state))
+
+        self._buffer_np[0] = state
+        with torch.inference_mode():
+            return self._forward(1).argmax().item()
+
+    def _forward(self, batch_size: int) -> torch.Tensor:
+        return self._model(self._buffer[:batch_size].to(self._device, non_blocking=True))
@@ -0,0 +1,59 @@
+import time
+from typing import Dict
+
+
+class _Section:
+    """ context manager adding the wall time of its block to one Timings entry """
+    __slots__ = ('_timings', '_name', '_start')
+
+    def __init__(self, timings: 'Timings', name: str):
+        self._timings = timings
+        self._name = name
+        self._start = 0.
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._timings.add(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class Timings:
+    """
+    cumulative wall time and call counts of named code sections
+        with timings('simulation'):
+            ...
+    report() -> {name: {'total': seconds, 'calls': n, 'mean': seconds per call}}
+    """
+
+    def __init__(self):
+        self._totals : Dict[str, float] = {}
+        self._calls : Dict[str, int] = {}
+        self._sections : Dict[str, _Section] = {}
+
+    def __call__(self, name: str) -> _Section:
+        section = self._sections.get(name)
+        if section is None:
+            section = self._sections[name] = _Section(self, name)
+        return section
+
+    def add(self, name: str, seconds: float):
+        self._totals[name] = self._totals.get(name, 0.) + seconds
+        self._calls[name] = self._calls.get(name, 0) + 1
+
+    def totals(self) -> Dict[str, float]:
+        return dict(self._totals)
+
+    def report(self) -> Dict[str, dict]:
+        return {name: {'total': total, 'calls': self._calls[name], 'mean': total / self._calls[name]}
+                for name, total in self._totals.items()}
+
+    def reset(self):
+        self._totals.clear()
+        self._calls.clear()
+
+    def __str__(self) -> str:
+        return '\n'.join(f' - {name:12s} -- total: {r["total"]:8.3f} s -- calls: {r["calls"]:7d} -- mean: {r["mean"]*1e3:8.3f} ms'
+                         for name, r in self.report().items())
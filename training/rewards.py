@@ -1,5 +1,7 @@
-from abc import abstractmethod
-import traci
+import numpy as np
+from typing import List, Union
+
+from observation import LaneObserver
 
 
 def get_rewards_tuple(who: str = ""):
@@ -16,20 +18,46 @@ def get_metrics_tuple():
     return QueueMetric, ThroughputReward
 
 
+def lanes_total(features: np.ndarray, feature: str, lane_idx: Union[slice, np.ndarray] = slice(None)) -> np.ndarray:
+    """ sum of a feature over given lanes of lane features (..., lanes, features) in LaneObserver.COLUMNS order """
+    return features[..., lane_idx, LaneObserver.COLUMNS[feature]].sum(axis=-1)
+
+
 class DiffReward():
-    """ Abstract class for environment's reward which is calculated as difference between two steps """
-    def __init__(self):
-        self.lanes = [lane for lane in traci.lane.getIDList() if 'i' in lane]
+    """ 
+    Abstract class for environment's reward which is calculated as difference between two steps \\
+    the compared value is the sum of LaneObserver's FEATURE over reward's lanes
+    """
+    FEATURE : str = None
+
+    def __init__(self, observer: LaneObserver, lanes: Union[None, List[str]] = None):
+        self._observer = observer
+        self.lanes = self.default_lanes(observer) if lanes is None else lanes
+        self._lane_idx = observer.indices(self.lanes)
         self.type = 'diff'
         self.stored_val = 0
 
-    @abstractmethod
     def read_current(self):
-        pass 
+        return float(lanes_total(self._observer.values(), self.FEATURE, self._lane_idx))
+
+    @staticmethod
+    def default_lanes(observer: LaneObserver) -> List[str]:
+        """ lanes used without explicit ones, observer may be anything with lanes and incoming lists """
+        return observer.incoming
+
+    @classmethod
+    def from_features(cls, features_t: np.ndarray, features_t1: np.ndarray, 
+                      lane_idx: Union[slice, np.ndarray] = slice(None)) -> np.ndarray:
+        """ rewards of recorded transitions, lane features (..., lanes, features) before and after each step """
+        return lanes_total(features_t, cls.FEATURE, lane_idx) - lanes_total(features_t1, cls.FEATURE, lane_idx)
 
     def save_current(self):
         self.stored_val = self.read_current()
 
+    def reset(self):
+        """ called by the environment on reset, the next difference is taken against the new episode's start """
+        self.save_current()
+
     def calculate(self) -> float:
         prev_val = self.stored_val
         self.stored_val = self.read_current()
@@ -38,12 +66,7 @@ class DiffReward():
 
 class WaitDiffReward(DiffReward):
     """ Difference in sum of vehicles' waiting times """
-    def read_current(self):
-        current = 0
-        for lane in self.lanes:
-            current += traci.lane.getWaitingTime(lane)
-
-        return current
+    FEATURE = 'waiting'
 
     def __str__(self):
         return "Total waiting time decrease"
@@ -55,12 +78,7 @@ class WaitDiffReward(DiffReward):
 
 class QueueDiffReward(DiffReward):
     """ Difference in number of waiting vehicles on incoming lanes """
-    def read_current(self):
-        current = 0
-        for lane in self.lanes:
-            current += traci.lane.getLastStepHaltingNumber(lane)
-
-        return current
+    FEATURE = 'halting'
 
     def __str__(self):
         return "Total queue decrease"
@@ -72,12 +90,7 @@ class QueueDiffReward(DiffReward):
 
 class CountDiffReward(DiffReward):
     """ Difference in number of vehicles on incoming lanes"""
-    def read_current(self):
-        current = 0
-        for lane in self.lanes:
-            current += traci.lane.getLastStepVehicleNumber(lane)
-
-        return current
+    FEATURE = 'count'
 
     def __str__(self):
         return "Number of cars decrease (throughput)"
@@ -88,24 +101,42 @@ class CountDiffReward(DiffReward):
 
 
 class Reward():
-    """ Abstract class for environment's reward which is calculated every step """
-    def __init__(self):
-        self.lanes = [lane for lane in traci.lane.getIDList() if 'i' in lane]
+    """ 
+    Abstract class for environment's reward which is calculated every step \\
+    the reward is SIGN * sum of LaneObserver's FEATURE over reward's lanes
+    """
+    FEATURE : str = None
+    SIGN : float = 1.
+
+    def __init__(self, observer: LaneObserver, lanes: Union[None, List[str]] = None):
+        self._observer = observer
+        self.lanes = self.default_lanes(observer) if lanes is None else lanes
+        self._lane_idx = observer.indices(self.lanes)
         self.type = 'other'
 
-    @abstractmethod
     def calculate(self) -> float:
-        pass 
+        return self.SIGN * float(lanes_total(self._observer.values(), self.FEATURE, self._lane_idx))
+
+    def reset(self):
+        """ called by the environment on reset, nothing is carried between steps """
+        pass
+
+    @staticmethod
+    def default_lanes(observer: LaneObserver) -> List[str]:
+        """ lanes used without explicit ones, observer may be anything with lanes and incoming lists """
+        return observer.incoming
+
+    @classmethod
+    def from_features(cls, features_t: np.ndarray, features_t1: np.ndarray, 
+                      lane_idx: Union[slice, np.ndarray] = slice(None)) -> np.ndarray:
+        """ rewards of recorded transitions, lane features (..., lanes, features) before and after each step """
+        return cls.SIGN * lanes_total(features_t1, cls.FEATURE, lane_idx)
 
 
 class NegWaitReward(Reward):
     """ Negative sum of vehicles' waiting times """
-    def calculate(self):
-        current = 0
-        for lane in self.lanes:
-            current -= traci.lane.getWaitingTime(lane)
-
-        return current 
+    FEATURE = 'waiting'
+    SIGN = -1.
 
     def __str__(self):
         return "Negation of total waiting time"
@@ -117,12 +148,8 @@ class NegWaitReward(Reward):
 
 class NegQueueReward(Reward):
     """ Negative number of waiting cars on incoming lanes """
-    def calculate(self):
-        current = 0
-        for lane in self.lanes:
-            current -= traci.lane.getLastStepHaltingNumber(lane)
-
-        return current 
+    FEATURE = 'halting'
+    SIGN = -1.
 
     def __str__(self):
         return "Negation of total queue"
@@ -134,16 +161,11 @@ class NegQueueReward(Reward):
 
 class SpeedReward(Reward):
     """ Sum of lanes' mean speeds """
-    def __init__(self):
-        super().__init__()
-        self.lanes = traci.lane.getIDList()
-
-    def calculate(self):
-        current = 0
-        for lane in self.lanes:
-            current += traci.lane.getLastStepMeanSpeed(lane)
+    FEATURE = 'speed'
 
-        return current 
+    @staticmethod
+    def default_lanes(observer: LaneObserver) -> List[str]:
+        return observer.lanes
 
     def __str__(self):
         return "Sum of speeds"
@@ -155,24 +177,34 @@ class SpeedReward(Reward):
 
 class ThroughputReward():
     """ Number of vehicles that passed the intersection since last step """
-    def __init__(self):
+    def __init__(self, observer: LaneObserver, lanes: Union[None, List[str]] = None):
+        self._observer = observer
+        self.lanes = self.default_lanes(observer) if lanes is None else lanes
+        # vehicle ids arrive with the lane subscriptions, no per-vehicle calls
+        self._observer.track_vehicles(self.lanes)
         self.vehicles = self.read_current() 
 
     def read_current(self):
-        vehicles = traci.vehicle.getIDList()
-        return [vehicle for vehicle in vehicles if
-                                    'i' in traci.vehicle.getRoadID(vehicle)]
+        return self._observer.vehicles(self.lanes)
 
     def calculate(self):
         old_vehicles = self.vehicles # incoming vehicles at t_0
         self.vehicles = self.read_current() # incoming vehicles at t_1
 
-        current = 0
-        for vehicle in old_vehicles:
-            if vehicle not in self.vehicles: # vehicle left incoming lane
-                current += 1
+        return len(old_vehicles - self.vehicles) # vehicles that left incoming lanes
+
+    def reset(self):
+        """ called by the environment on reset, vehicles of the previous episode are forgotten """
+        self.vehicles = self.read_current()
+
+    @staticmethod
+    def default_lanes(observer: LaneObserver) -> List[str]:
+        return observer.incoming
 
-        return current 
+    @classmethod
+    def from_throughput(cls, throughput: np.ndarray, lane_idx: Union[slice, np.ndarray] = slice(None)) -> np.ndarray:
+        """ rewards of recorded transitions, vehicles (..., lanes) that left the incoming lanes during each step """
+        return throughput[..., lane_idx].sum(axis=-1)
 
     @staticmethod
     def desc():
@@ -181,13 +213,7 @@ class ThroughputReward():
 
 class QueueMetric(Reward):
     """ Number of waiting cars on incoming lanes - metric"""
-    
-    def calculate(self):
-        current = 0
-        for lane in self.lanes:
-            current += traci.lane.getLastStepHaltingNumber(lane)
-
-        return current 
+    FEATURE = 'halting'
 
     def __str__(self):
         return "Total queue metric"
@@ -0,0 +1,83 @@
+import hashlib, json
+from pathlib import Path
+from typing import List, Union
+import pandas as pd
+
+from generator import TrafficGenerator
+
+
+class Scenario:
+    """
+    fixed evaluation scenario: demand, horizon and seed \\
+    its route file is generated once into the route cache and shared by every evaluated agent
+    """
+
+    def __init__(self, route_car_freq: List[float], max_timesteps: int = 1000, seed: int = 0,
+                 yellow_duration: int = 4, green_duration: int = 4,
+                 route_cache_dir: str = 'intersection/route_cache'):
+        self.route_car_freq = list(route_car_freq)
+        self.max_timesteps = max_timesteps
+        self.seed = seed
+        self.yellow_duration = yellow_duration
+        self.green_duration = green_duration
+        self.route_cache_dir = route_cache_dir
+
+    def env_params(self) -> dict:
+        """ environment kwargs reproducing the scenario, the seed makes it load the cached route file """
+        return {
+            "route_car_freq": self.route_car_freq,
+            "max_steps": self.max_timesteps,
+            "seed": self.seed,
+            "yellow_duration": self.yellow_duration,
+            "green_duration": self.green_duration,
+            "route_cache_dir": self.route_cache_dir
+        }
+
+    def materialize(self) -> str:
+        """ generates the route file unless it is already cached, returns its path """
+        generator = TrafficGenerator(max_steps=self.max_timesteps*(self.yellow_duration+self.green_duration),
+                                     route_car_freq=self.route_car_freq)
+        return generator.generate_route_file(seed=self.seed, cache_dir=self.route_cache_dir)
+
+    def key(self) -> dict:
+        return {k: v for k, v in self.env_params().items() if k != "route_cache_dir"}
+
+
+SCENARIOS = {
+    "default": Scenario(route_car_freq=[0.02, 0.05, 0.01]*4, max_timesteps=1000, seed=0),
+    "light": Scenario(route_car_freq=[0.01, 0.02, 0.005]*4, max_timesteps=1000, seed=0),
+    "heavy": Scenario(route_car_freq=[0.05, 0.1, 0.03]*4, max_timesteps=1000, seed=0),
+}
+
+
+def get_scenario(name: str) -> Scenario:
+    return SCENARIOS[name]
+
+
+class ResultsCache:
+    """
+    on-disk cache of evaluation summaries (one-row DataFrames), \\
+    keyed by everything that determines the result: agent and checkpoint, scenario and metrics
+    """
+
+    def __init__(self, cache_dir: Union[str, Path] = 'models/evaluation_cache'):
+        self._dir = Path(cache_dir)
+        self._dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(**parts) -> str:
+        return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key: str) -> Union[None, pd.DataFrame]:
+        cached_file = self._dir / f'{key}.pkl'
+        if not cached_file.exists():
+            return None
+        return pd.read_pickle(cached_file)
+
+    def put(self, key: str, df: pd.DataFrame):
+        # pickled frames come back with the very same values and dtypes, json rounds doubles to 15 digits
+        df.to_pickle(self._dir / f'{key}.pkl')
+
+
+def file_digest(path: Union[str, Path]) -> str:
+    return hashlib.sha1(Path(path).read_bytes()).hexdigest()
@@ -1,33 +1,56 @@
-from abc import abstractmethod
-import traci
 import numpy as np
+from typing import List, Tuple, Union
+
+from observation import LaneObserver
 
 
 def get_states_tuple(who: str = ""):
     return (QueueState, CountState, WaitState)
 
 class State():
-    """ Abstract class for environment's state representation """
-    def __init__(self):
-        self.lanes = [lane for lane in traci.lane.getIDList() if 'i' in lane]
+    """ 
+    Abstract class for environment's state representation \\
+    a state is made of LaneObserver's FEATURES of its lanes, stacked feature by feature (e.g. all queue lengths, 
+    then all waiting times), taken from the lanes x features matrix of the step with no further simulation queries; 
+    the same code recomputes states of recorded lane features, see from_features
+    """
+    FEATURES : Tuple[str, ...] = ()
+    _COLUMNS = np.zeros(0, dtype=np.int64)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._COLUMNS = np.array([LaneObserver.COLUMNS[feature] for feature in cls.FEATURES], dtype=np.int64)
+
+    def __init__(self, observer: LaneObserver, lanes: Union[None, List[str]] = None):
+        self._observer = observer
+        self.lanes = self.default_lanes(observer) if lanes is None else lanes
+        self._lane_idx = observer.indices(self.lanes)
+        # positions of the state values in the flattened snapshot, one take() per step
+        self._flat_idx = (self._COLUMNS[:, None] + self._lane_idx[None, :] * len(LaneObserver.COLUMNS)).ravel()
 
-    @abstractmethod
     def get(self) -> np.ndarray:
-        pass 
+        """ float32 state vector of len(FEATURES) * len(lanes) values """
+        return self._observer.values().take(self._flat_idx)
+
+    def size(self) -> int:
+        return len(self.FEATURES) * len(self.lanes)
+
+    @staticmethod
+    def default_lanes(observer: LaneObserver) -> List[str]:
+        """ lanes used without explicit ones, observer may be anything with lanes and incoming lists """
+        return observer.incoming
+
+    @classmethod
+    def from_features(cls, features: np.ndarray, lane_idx: Union[slice, np.ndarray] = slice(None)) -> np.ndarray:
+        """ states (..., len(FEATURES) * lanes) of lane features (..., lanes, features) in LaneObserver.COLUMNS order """
+        values = np.swapaxes(features[..., cls._COLUMNS][..., lane_idx, :], -1, -2)
+        return np.ascontiguousarray(values, dtype=np.float32).reshape(*values.shape[:-2], -1)
 
 
 class SpeedState(State):
     """ Counts mean speed for ever incoming lane """
     # TODO: what about empty lanes?
-    def __init__(self):
-        super().__init__()
-        self.speeds = np.zeros((len(self.lanes),))
-
-    def get(self):
-        for i, lane in enumerate(self.lanes):
-            self.speeds[i] = traci.lane.getLastStepMeanSpeed(lane)
-
-        return self.speeds
+    FEATURES = ('speed',)
 
     def __str__(self):
         return "Mean speeds"
@@ -35,15 +58,7 @@ class SpeedState(State):
 
 class QueueState(State):
     """ Counts how many vehicles are stationary on every incoming lane """
-    def __init__(self):
-        super().__init__()
-        self.queues = np.zeros((len(self.lanes),))
-
-    def get(self):
-        for i, lane in enumerate(self.lanes):
-            self.queues[i] = traci.lane.getLastStepHaltingNumber(lane)
-
-        return self.queues
+    FEATURES = ('halting',)
 
     def __str__(self):
         return "Queue lengths"
@@ -55,15 +70,7 @@ class QueueState(State):
 
 class CountState(State):
     """ Counts how many vehicles are on every incoming lane """
-    def __init__(self):
-        super().__init__()
-        self.counts = np.zeros((len(self.lanes),))
-
-    def get(self):
-        for i, lane in enumerate(self.lanes):
-            self.counts[i] = traci.lane.getLastStepVehicleNumber(lane)
-
-        return self.counts
+    FEATURES = ('count',)
 
     def __str__(self):
         return "Number of cars"
@@ -75,15 +82,7 @@ class CountState(State):
 
 class WaitState(State):
     """ Cummulative waiting time for each incoming lane """
-    def __init__(self):
-        super().__init__()
-        self.times = np.zeros((len(self.lanes),))
-
-    def get(self):
-        for i, lane in enumerate(self.lanes):
-            self.times[i] = traci.lane.getWaitingTime(lane)
-
-        return self.times
+    FEATURES = ('waiting',)
 
     def __str__(self):
         return "Total waiting times"
@@ -91,3 +90,15 @@ class WaitState(State):
     @staticmethod
     def desc():
         return "Total waiting times"
+
+
+class QueueWaitState(State):
+    """ Queue lengths of every incoming lane followed by their cummulative waiting times """
+    FEATURES = ('halting', 'waiting')
+
+    def __str__(self):
+        return "Queue lengths and total waiting times"
+    
+    @staticmethod
+    def desc():
+        return "Queue length and total waiting time (per lane)"
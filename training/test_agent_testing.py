@@ -0,0 +1,28 @@
+import json
+import pandas as pd
+import pytest
+
+import agent_testing
+from scenarios import ResultsCache
+
+
+@pytest.mark.parametrize('seed, simulations', [(None, 2), (0, 1)])
+def test_models_summaries_cache(tmp_path, monkeypatch, seed, simulations):
+    model_dir = tmp_path / 'models' / '1638899442'
+    model_dir.mkdir(parents=True)
+    (model_dir / 'hiperparams.json').write_text(json.dumps({}))
+
+    calls = []
+    def model_summary(model_dir, *args):
+        calls.append(model_dir)
+        return pd.DataFrame({"id": [model_dir.name], "NegQueueReward (mean)": [float(len(calls))]})
+    monkeypatch.setattr(agent_testing, '_model_summary', model_summary)
+    monkeypatch.setattr(agent_testing, 'model_cache_key', lambda model_dir, *args: model_dir.name)
+
+    cache = ResultsCache(tmp_path / 'cache')
+    first = agent_testing.models_summaries(tmp_path / 'models', seed=seed, results_cache=cache)
+    second = agent_testing.models_summaries(tmp_path / 'models', seed=seed, results_cache=cache)
+    # unseeded evaluations are simulated again and never stored
+    assert len(calls) == simulations
+    assert second.equals(first) == (seed is not None)
+    assert (cache.get('1638899442') is None) == (seed is None)
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from memory import ReplayBuffer, MemoryPalace
+
+
+def experience(i: int):
+    return np.full(4, i, dtype=np.float32), i % 2, float(i), np.full(4, i + 1, dtype=np.float32), False
+
+
+@pytest.mark.parametrize('buffer_class', [ReplayBuffer, MemoryPalace])
+def test_sample_empty_buffer(buffer_class):
+    buffer = buffer_class(8)
+    with pytest.raises(ValueError):
+        buffer.sample(4)
+
+
+@pytest.mark.parametrize('buffer_class', [ReplayBuffer, MemoryPalace])
+@pytest.mark.parametrize('max_length', [1, 8])
+def test_sample_at_most_stored(buffer_class, max_length):
+    buffer = buffer_class(max_length)
+    for i in range(3):
+        buffer.append(experience(i))
+    states, actions, rewards, next_states, dones, *_ = buffer.sample(32)
+    assert len(actions) == len(buffer) == min(3, max_length)
+    assert states.shape == (len(buffer), 4)
+    assert np.all(next_states == states + 1)
@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+
+from scenarios import ResultsCache, get_scenario
+
+
+def test_cache_key():
+    scenario = get_scenario("default")
+    key = ResultsCache.key(model="1638899442", scenario=scenario.key(), metrics=["NegQueueReward"], seed=0)
+    assert key == ResultsCache.key(seed=0, metrics=["NegQueueReward"], scenario=scenario.key(), model="1638899442")
+    assert key != ResultsCache.key(model="1638899442", scenario=scenario.key(), metrics=["NegQueueReward"], seed=1)
+    assert key != ResultsCache.key(model="1638899442", scenario=get_scenario("heavy").key(), metrics=["NegQueueReward"], seed=0)
+
+
+def test_cache_round_trip(tmp_path):
+    cache = ResultsCache(tmp_path)
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"id": ["1638899442"], "state_class": ["QueueState"], "NegQueueReward (mean)": [-8.725000000000001],
+                       "ThroughputReward (mean)": rng.random(1), "float32": rng.random(1).astype(np.float32), "count": [3]})
+    key = ResultsCache.key(model="1638899442")
+    assert cache.get(key) is None
+    cache.put(key, df)
+    cached = cache.get(key)
+    assert cached.equals(df)
+    assert (cached.dtypes == df.dtypes).all()
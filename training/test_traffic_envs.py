@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from traffic_envs import Environment_Traffic_Lights
+from states import QueueState
+from rewards import NegQueueReward
+
+
+def make_env(tmp_path, **kwargs) -> Environment_Traffic_Lights:
+    # route files stay in tmp_path, the repository's route file is not touched
+    params = {'max_steps': 300, 'route_car_freq': [0.002]*12, 'seed': 0, 'backend': 'libsumo',
+              'route_file': str(tmp_path / 'test.rou.xml'), 'route_cache_dir': str(tmp_path / 'route_cache'), **kwargs}
+    return Environment_Traffic_Lights(QueueState, NegQueueReward, **params)
+
+
+@pytest.mark.parametrize('route_injection', [False, True])
+def test_skip_idle_holds_green_phase(tmp_path, route_injection):
+    env = make_env(tmp_path, skip_idle=True, route_injection=route_injection)
+    rng = np.random.RandomState(0)
+    try:
+        env.reset()
+        for _ in range(300):
+            action = rng.randint(4)
+            env.step(action)
+            assert env._sim.trafficlight.getPhase('0') == action*2
+        assert env.skipped_time() > 100  # long skips were taken
+    finally:
+        env.close()
+
+
+def test_demand_lasts_after_snapshot_restore(tmp_path):
+    max_steps = 150
+    env = make_env(tmp_path, max_steps=max_steps, route_car_freq=[0.02, 0.05, 0.01]*4, snapshot_dir=str(tmp_path / 'snapshots'),
+                   warmup_steps=300, snapshot_pool=2)
+    try:
+        for snapshot_file in env._snapshot_files:
+            env._restore_snapshot(snapshot_file)
+            start = env.sim_time()
+            for t in range(max_steps):
+                env.step(t % 2)  # every step switches, i.e. lasts yellow + green
+            assert env.sim_time() >= start + (max_steps - 1)*8
+            # vehicles of the route file still wait to depart at the end of the episode
+            sim = env._sim
+            assert sim.simulation.getMinExpectedNumber() > sim.vehicle.getIDCount()
+    finally:
+        env.close()
@@ -1,24 +1,61 @@
 import numpy as np
 import traci
 import sys, os
+import hashlib, json
+from pathlib import Path
+try:
+    import libsumo
+except ImportError:
+    libsumo = None
 from sumolib import checkBinary
 from typing import List, Union, Tuple
 
-from generator import TrafficGenerator
+from generator import TrafficGenerator, GridTrafficGenerator, generate_grid_network
+from observation import LaneObserver
+from profiling import Timings
 from rewards import *
 from states import *
 
-def sumo_init(sumo_cfg_file:str, gui:bool):
+BACKENDS = ('traci', 'libsumo')
+
+
+def simulation_backend(backend:str = 'traci', gui:bool = False):
+    """ 
+    returns the module controlling SUMO \\
+    libsumo runs the simulation in-process (no socket), but it has no GUI, so traci is used when gui=True
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown simulation backend: {backend}, expected one of {BACKENDS}')
+    if backend == 'libsumo' and not gui:
+        if libsumo is not None:
+            return libsumo
+        print('libsumo is not installed, falling back to traci')
+    return traci
+
+
+def sumo_init(sumo_cfg_file:str, gui:bool, backend:str = 'traci', route_file:Union[None, str] = None):
+    """ 
+    starts SUMO and returns the backend module the simulation is bound to \\
+    route_file overrides the one listed in the config, so several simulations can run side by side
+    """
     if 'SUMO_HOME' in os.environ:
         tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
         sys.path.append(tools)
     else:
         sys.exit('Environment variable SUMO_HOME not declared.')
     sumo_binary = checkBinary('sumo-gui') if gui else checkBinary('sumo')
-    traci.start([sumo_binary, "-c", sumo_cfg_file, '--start' ])
+    sim = simulation_backend(backend, gui)
+    route_args = [] if route_file is None else ['-r', route_file]
+    sim.start([sumo_binary, "-c", sumo_cfg_file, *route_args, '--start' ])
+    return sim
     # traci.start([sumo_binary, "-c", sumo_cfg_file, '--start' , '--no-warnings'])
 
 
+def snapshot_warmup_steps(warmup_steps:int, snapshot_pool:int, k:int) -> int:
+    """ warm-up length [s] of snapshot k of the pool, entries are spread over [warmup_steps, 2*warmup_steps) """
+    return warmup_steps + warmup_steps * k // snapshot_pool
+
+
 class Environment_NS_Only:
     '''
     simplest environment: cars are only taking NS route
@@ -91,7 +128,7 @@ class Environment_NS_Only:
 class Environment_Traffic_Lights:
     '''
     traffic lights environment base
-        - state: any State inheriting class
+        - state: any State inheriting class, returned as a float32 vector
         - actions: {0,1} -> sets green light for EW, NS respectively
         - reward: any Reward inheriting class
     
@@ -110,23 +147,63 @@ class Environment_Traffic_Lights:
     def __init__(self, state_class : State, reward_class : Union[Reward, DiffReward], 
                  max_steps : int = 1000, route_car_freq : Union[None,List[float]] = None,
                  sumo_cfg_file : str = 'intersection/my_net.sumocfg', route_file : str = 'intersection/my_net.rou.xml', 
-                 gui : bool = False, yellow_duration : int = 4, green_duration : int = 4, **kwargs):
-
-        self.traffic_generator = TrafficGenerator(route_car_freq=route_car_freq, max_steps=max_steps*(yellow_duration+green_duration))
-        self.traffic_generator.generate_route_file(route_file=route_file)
+                 gui : bool = False, yellow_duration : int = 4, green_duration : int = 4, backend : str = 'traci', 
+                 seed : Union[None, int] = None, route_cache_dir : str = 'intersection/route_cache', 
+                 route_injection : bool = False, snapshot_dir : Union[None, str] = None, warmup_steps : int = 0, 
+                 snapshot_pool : int = 1, action_repeat : int = 1, skip_idle : bool = False, **kwargs):
+
+        # episodes restored from a snapshot continue the route file from the snapshot time, 
+        # so its demand has to last for the longest warm-up as well
+        horizon = max_steps*(yellow_duration+green_duration*action_repeat)
+        if snapshot_dir is not None and warmup_steps > 0 and not route_injection:
+            horizon += snapshot_warmup_steps(warmup_steps, snapshot_pool, snapshot_pool - 1)
+        self.traffic_generator = TrafficGenerator(route_car_freq=route_car_freq, max_steps=horizon)
+        self._seed = seed
+        self._route_cache_dir = route_cache_dir
+        self._route_injection = route_injection
+        if route_injection:
+            active_route_file = self.traffic_generator.generate_route_definitions(route_file=route_file)
+        else:
+            active_route_file = self.traffic_generator.generate_route_file(seed=seed, route_file=route_file, cache_dir=route_cache_dir)
         
-        sumo_init(sumo_cfg_file, gui)
+        self._sim = sumo_init(sumo_cfg_file, gui, backend, active_route_file)
 
         self._sumo_cfg_file = sumo_cfg_file
         self._route_file = route_file
         self._gui = gui
         self._yellow_duration = yellow_duration
         self._green_duration = green_duration
+        self._backend = backend
+        # an action is held for action_repeat green periods, one decision per step
+        self._action_repeat = action_repeat
 
-        self._STATE : State = state_class()
-        self._REWARD : Reward = reward_class()
+        self._observer = LaneObserver(self._sim)
+        self._STATE : State = state_class(self._observer)
+        self._REWARD : Reward = reward_class(self._observer)
+
+        # idle periods (no vehicles on incoming lanes) are skipped up to the next known departure
+        self._skip_idle = skip_idle
+        self._incoming_idx = self._observer.indices(self._observer.incoming) if skip_idle else None
+        self._departure_times = np.zeros(0, dtype=np.int64)
+        self._skipped_time = 0
 
         self._last_action = 0
+        # wall time of simulation, observation, state and reward sections, see timings()
+        self._timings = Timings()
+
+        # simulation time and vehicle injection bookkeeping
+        self._time = 0
+        self._episode = 0
+        self._schedule_steps = np.zeros(0, dtype=np.int64)
+        self._schedule_routes = np.zeros(0, dtype=np.int64)
+        self._schedule_start = 0
+        self._schedule_pos = 0
+
+        # warmed-up simulation states episodes start from
+        self._snapshot_dir = snapshot_dir
+        self._warmup_steps = warmup_steps
+        self._snapshot_pool = snapshot_pool
+        self._snapshot_files : List[Path] = []
         
         self._hp = {
             "state_class": self._STATE.__class__.__name__,
@@ -137,16 +214,132 @@ class Environment_Traffic_Lights:
             "route_file": self._route_file,
             "gui": self._gui,
             "yellow_duration": self._yellow_duration,
-            "green_duration": self._green_duration
+            "green_duration": self._green_duration,
+            "backend": self._backend,
+            "seed": self._seed,
+            "route_injection": self._route_injection,
+            "snapshot_dir": self._snapshot_dir,
+            "warmup_steps": self._warmup_steps,
+            "snapshot_pool": self._snapshot_pool,
+            "action_repeat": self._action_repeat,
+            "skip_idle": self._skip_idle
         }
+
+        if self._snapshot_dir is not None and self._warmup_steps > 0:
+            self.build_snapshots()
         
         self.reset()
 
     def reset(self):
         """ resets the environment and returns s_0 """
-        self.traffic_generator.generate_route_file(route_file=self._route_file)
-        traci.load(["-c", self._sumo_cfg_file, '--start'])
-        return tuple(self._state())
+        with self._timings('reset'):
+            self._last_action = 0  # the program starts from phase 0 again
+            if self._snapshot_files:
+                self._restore_snapshot(self._snapshot_files[np.random.randint(len(self._snapshot_files))])
+            else:
+                self._fresh_reset()
+            if self._skip_idle:
+                self._skip_idle_period()
+            self._REWARD.reset()  # the first reward of the episode compares against s_0
+            return self._state()
+
+    def build_snapshots(self):
+        """ 
+        warms up snapshot_pool simulations and saves their states, pool entry k is warmed up for 
+        warmup_steps * (1 + k / snapshot_pool) seconds, so entries differ also when every episode 
+        replays the same seeded demand \\
+        snapshots already present in snapshot_dir for the same network, demand (including its horizon) 
+        and environment settings are reused
+        """
+        snapshot_dir = Path(self._snapshot_dir)
+        snapshot_dir.mkdir(parents=True, exist_ok=True)
+        mode = 'injection' if self._route_injection else 'file'
+        key = hashlib.sha1(json.dumps({'demand': self.traffic_generator.cache_key(self._seed), 'mode': mode,
+                                       'sumo_cfg_file': str(Path(self._sumo_cfg_file).resolve()),
+                                       'yellow_duration': self._yellow_duration, 'green_duration': self._green_duration,
+                                       'action_repeat': self._action_repeat,
+                                       'horizon': self.traffic_generator.max_steps}).encode()).hexdigest()
+
+        self._snapshot_files = []
+        for k in range(self._snapshot_pool):
+            warmup_steps = snapshot_warmup_steps(self._warmup_steps, self._snapshot_pool, k)
+            snapshot_file = snapshot_dir / f'{key}_w{warmup_steps}_{k}.xml'
+            if not snapshot_file.exists():
+                self._fresh_reset()
+                self._environment_step(warmup_steps)
+                self._sim.simulation.saveState(str(snapshot_file))
+            self._snapshot_files.append(snapshot_file)
+
+    def _fresh_reset(self):
+        if self._route_injection:
+            self._reset_injected()
+            return
+
+        # with a fixed seed every episode replays the same (cached) demand
+        active_route_file = self.traffic_generator.generate_route_file(seed=self._seed, route_file=self._route_file, 
+                                                                       cache_dir=self._route_cache_dir)
+        self._sim.load(["-c", self._sumo_cfg_file, '-r', active_route_file, '--start'])
+        self._observer.subscribe()
+        self._time = 0
+        if self._skip_idle:
+            self._departure_times = self._file_departure_times()
+
+    def _file_departure_times(self) -> np.ndarray:
+        """ departure seconds of the vehicles in the loaded route file """
+        if self._seed is None:
+            return self.traffic_generator.last_departure_steps
+        if len(self._departure_times) == 0:  # the same file every episode, drawn once
+            return np.unique(self.traffic_generator.departure_schedule(seed=self._seed)[0])
+        return self._departure_times
+
+    def _restore_snapshot(self, snapshot_file:Path):
+        """ 
+        continues from a saved warmed-up state, in route injection mode a new departure schedule 
+        starts at the snapshot time, otherwise the loaded route file continues from there
+        """
+        self._sim.simulation.loadState(str(snapshot_file))
+        self._sim.trafficlight.setPhase("0", 0)
+        self._time = int(self._sim.simulation.getTime())
+        self._observer.subscribe()
+        if self._route_injection:
+            self._episode += 1
+            self._start_schedule()
+        elif self._skip_idle:
+            self._departure_times = self._file_departure_times()
+
+    def _reset_injected(self):
+        """ 
+        in-simulation reset used with route injection: the network stays loaded, 
+        remaining vehicles are removed and a new departure schedule is drawn
+        """
+        if self._episode > 0:
+            for vehicle in (*self._sim.vehicle.getIDList(), *self._sim.simulation.getPendingVehicles()):
+                self._sim.vehicle.remove(vehicle)
+            self._sim.trafficlight.setPhase("0", 0)
+            self._sim.simulationStep()  # applies the removals, lanes report empty afterwards
+            self._time = int(self._sim.simulation.getTime())
+            self._observer.update()
+        self._episode += 1
+        self._start_schedule()
+
+    def _start_schedule(self):
+        self._schedule_steps, self._schedule_routes = self.traffic_generator.departure_schedule(seed=self._seed)
+        self._schedule_start = self._time
+        self._schedule_pos = 0
+        self._departure_times = self._schedule_start + np.unique(self._schedule_steps)
+
+    def _inject_vehicles(self, until:int):
+        """ adds scheduled vehicles departing before the given simulation time """
+        end = np.searchsorted(self._schedule_steps, until - self._schedule_start)
+        routes = self.traffic_generator.routes
+        for step, route_idx in zip(self._schedule_steps[self._schedule_pos:end].tolist(), 
+                                   self._schedule_routes[self._schedule_pos:end].tolist()):
+            route = routes[route_idx][0]
+            depart = self._schedule_start + step
+            # named after the absolute departure time, unique also against vehicles restored from snapshots
+            self._sim.vehicle.add(f'{route}_{depart}', route, typeID='standard_car', 
+                                  depart=str(depart), departLane='random', departSpeed='10')
+        self._schedule_pos = end
 
     def step(self, action:int):
         """ 
@@ -157,6 +350,9 @@ class Environment_Traffic_Lights:
             1 : sets NS left turn lights green
             2 : sets EW lights green
             3 : sets EW left turn lights green
+        
+        the green phase is held for action_repeat green periods, 
+        r_t is the sum of rewards calculated after each of them
         """
 
         if action != self._last_action:
@@ -164,44 +360,258 @@ class Environment_Traffic_Lights:
             self._environment_step(self._yellow_duration)
         
         self._set_green_phase(action)
-        self._environment_step(self._green_duration)
+        reward = 0
+        for _ in range(self._action_repeat):
+            self._environment_step(self._green_duration)
+            self._observe()
+            reward += self._reward()
         
         self._last_action = action
 
+        info = {}
+        if self._skip_idle:
+            info['skipped_time'] = self._skip_idle_period()
+
         state = self._state()
-        reward = self._reward()
         done = self._done()
 
-        return tuple(state), reward, done, {}
+        return state, reward, done, info
 
     def close(self):
         """ closes the environment """
-        traci.close()
+        self._sim.close()
 
     def render(self, type='human'):
         """ renders the current environment state, no need for it though """
         pass
 
-    def _state(self) -> List[int]:
-        return self._STATE.get()
+    def _state(self) -> np.ndarray:
+        with self._timings('state'):
+            return self._STATE.get()
 
     def _reward(self) -> int:
-        return self._REWARD.calculate()
+        with self._timings('reward'):
+            return self._REWARD.calculate()
+
+    def _observe(self):
+        with self._timings('observation'):
+            self._observer.update()
     
     def _done(self) -> bool:
         return False
 
     def _set_yellow_phase(self, previous_action:int):
-        traci.trafficlight.setPhase("0", previous_action*2 + 1)
+        self._sim.trafficlight.setPhase("0", previous_action*2 + 1)
     
     def _set_green_phase(self, action:int):
-        traci.trafficlight.setPhase("0", action*2)
+        self._sim.trafficlight.setPhase("0", action*2)
     
+    def _skip_idle_period(self) -> int:
+        """ 
+        with no vehicles on incoming lanes, advances the simulation (current phase held) until 
+        the next scheduled vehicle has entered, returns the number of skipped seconds \\
+        the green phase is re-issued and extended over the skip, the static program (100 s phases) 
+        would otherwise switch phases by itself during a long one
+        """
+        if self._observer.get('count', self._incoming_idx).any():
+            return 0
+        next_departure = np.searchsorted(self._departure_times, self._time, side='right')
+        if next_departure == len(self._departure_times):
+            return 0
+        # a vehicle departing at second d is on its lane once the step d -> d+1 is done
+        skipped = int(self._departure_times[next_departure]) + 1 - self._time
+        self._set_green_phase(self._last_action)
+        self._sim.trafficlight.setPhaseDuration("0", float(skipped + self._green_duration))
+        self._environment_step(skipped)
+        self._observe()
+        self._skipped_time += skipped
+        return skipped
+
+    def skipped_time(self) -> int:
+        """ total simulated seconds skipped as idle since the environment was created """
+        return self._skipped_time
+
     def _environment_step(self, duration:int):
-        """ performs given number of steps in SUMO simulation """
-        for _ in range(duration):
-            traci.simulationStep()
+        """ advances SUMO simulation by given number of seconds in a single call """
+        with self._timings('simulation'):
+            if self._route_injection:
+                self._inject_vehicles(self._time + duration)
+            self._time += duration
+            self._sim.simulationStep(float(self._time))  # traci warns about int targets from 1000 s on
     
+    def observer(self) -> LaneObserver:
+        """ shared lane observation cache, metrics should be built on top of it """
+        return self._observer
+
+    def state_size(self) -> int:
+        return self._STATE.size()
+
+    def sim_time(self) -> int:
+        """ current SUMO simulation time [s] """
+        return self._time
+
+    def timings(self) -> Timings:
+        """ 
+        cumulative wall time of environment sections: simulation, observation, state, reward and reset 
+        (reset also contains the sections it runs), .report() for totals and means, .reset() to start over
+        """
+        return self._timings
+
+    def hiperparams(self) -> dict:
+        return self._hp
+
+
+class Environment_Grid:
+    '''
+    grid of signalised junctions (generated with netgenerate) controlled together
+        - state: matrix, row j is a state_class state of junction j built on its incoming lanes
+        - actions: vector, action of junction j indexes the green phases of its program
+        - reward: vector, reward_class reward of every junction
+    junctions are ordered by traffic light id (A0, A1, ..., B0, ...), 
+    a single batched policy forward pass (e.g. GreedyPolicy.act_batch) controls all of them
+
+    phases are set through their signal states, so SUMO never switches them on its own
+    '''
+
+    def __init__(self, state_class : State, reward_class : Union[Reward, DiffReward], 
+                 grid_x : int = 3, grid_y : int = 3, grid_length : float = 200., lanes : int = 2,
+                 max_steps : int = 1000, entry_freq : float = 0.05, route_car_freq : Union[None, List[float]] = None,
+                 network_dir : str = 'intersection/grid', route_file : Union[None, str] = None, gui : bool = False, 
+                 yellow_duration : int = 4, green_duration : int = 4, backend : str = 'traci', 
+                 seed : Union[None, int] = None, route_cache_dir : str = 'intersection/route_cache', **kwargs):
+
+        net_file, self._sumo_cfg_file = generate_grid_network(grid_x, grid_y, grid_length, lanes, network_dir)
+        self._route_file = str(Path(net_file).with_name(Path(net_file).name.replace('.net.xml', '.rou.xml'))) \
+                           if route_file is None else route_file
+        self.traffic_generator = GridTrafficGenerator(net_file, max_steps=max_steps*(yellow_duration+green_duration), 
+                                                      route_car_freq=route_car_freq, entry_freq=entry_freq)
+        self._seed = seed
+        self._route_cache_dir = route_cache_dir
+        active_route_file = self.traffic_generator.generate_route_file(seed=seed, route_file=self._route_file, 
+                                                                       cache_dir=route_cache_dir)
+
+        self._sim = sumo_init(self._sumo_cfg_file, gui, backend, active_route_file)
+        self._yellow_duration = yellow_duration
+        self._green_duration = green_duration
+
+        self._junctions = sorted(self._sim.trafficlight.getIDList())
+        self._junction_lanes = [list(dict.fromkeys(self._sim.trafficlight.getControlledLanes(tls))) for tls in self._junctions]
+        self._green_states, self._yellow_states = zip(*[self._program_states(tls) for tls in self._junctions])
+        if len({len(lanes) for lanes in self._junction_lanes}) > 1 or len({len(greens) for greens in self._green_states}) > 1:
+            raise ValueError('Environment_Grid expects junctions with equal numbers of incoming lanes and green phases')
+
+        self._observer = LaneObserver(self._sim)
+        self._STATES : List[State] = [state_class(self._observer, lanes) for lanes in self._junction_lanes]
+        self._REWARDS : List[Reward] = [reward_class(self._observer, lanes) for lanes in self._junction_lanes]
+
+        self._last_actions = np.zeros(len(self._junctions), dtype=np.int64)
+        self._time = 0
+        self._timings = Timings()
+
+        self._hp = {
+            "state_class": state_class.__name__,
+            "reward_class": reward_class.__name__,
+            "grid_x": grid_x,
+            "grid_y": grid_y,
+            "grid_length": grid_length,
+            "lanes": lanes,
+            "max_steps": max_steps,
+            "entry_freq": entry_freq,
+            "route_car_freq": route_car_freq,
+            "sumo_cfg_file": self._sumo_cfg_file,
+            "route_file": self._route_file,
+            "gui": gui,
+            "yellow_duration": yellow_duration,
+            "green_duration": green_duration,
+            "backend": backend,
+            "seed": seed
+        }
+
+        self.reset()
+
+    def _program_states(self, tls:str) -> Tuple[List[str], List[str]]:
+        """ signal states of the green phases of the junction's program and of the yellow phases following them """
+        phases = [phase.state for phase in self._sim.trafficlight.getAllProgramLogics(tls)[0].phases]
+        greens = [i for i, state in enumerate(phases) if 'y' not in state and 'G' in state]
+        yellows = [phases[(i + 1) % len(phases)] if 'y' in phases[(i + 1) % len(phases)] else phases[i] for i in greens]
+        return [phases[i] for i in greens], yellows
+
+    def reset(self) -> np.ndarray:
+        """ resets the environment and returns s_0 """
+        with self._timings('reset'):
+            active_route_file = self.traffic_generator.generate_route_file(seed=self._seed, route_file=self._route_file, 
+                                                                           cache_dir=self._route_cache_dir)
+            self._sim.load(["-c", self._sumo_cfg_file, '-r', active_route_file, '--start'])
+            self._observer.subscribe()
+            self._time = 0
+            self._last_actions[:] = 0
+            for j, tls in enumerate(self._junctions):
+                self._sim.trafficlight.setRedYellowGreenState(tls, self._green_states[j][0])
+            for reward in self._REWARDS:
+                reward.reset()
+            return self._state()
+
+    def step(self, actions:Union[List[int], np.ndarray]):
+        """ 
+        takes one action per junction 
+            -> returns S_t+1 (num_junctions x state_size), R_t (num_junctions), done, info_dict \\
+        junctions changing their phase go through yellow first, the others keep their green meanwhile
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        changed = np.flatnonzero(actions != self._last_actions)
+
+        if len(changed):
+            for j in changed.tolist():
+                self._sim.trafficlight.setRedYellowGreenState(self._junctions[j], self._yellow_states[j][self._last_actions[j]])
+            self._environment_step(self._yellow_duration)
+            for j in changed.tolist():
+                self._sim.trafficlight.setRedYellowGreenState(self._junctions[j], self._green_states[j][actions[j]])
+
+        self._environment_step(self._green_duration)
+        with self._timings('observation'):
+            self._observer.update()
+        self._last_actions = actions
+
+        return self._state(), self._reward(), self._done(), {}
+
+    def close(self):
+        """ closes the environment """
+        self._sim.close()
+
+    def _state(self) -> np.ndarray:
+        with self._timings('state'):
+            return np.stack([state.get() for state in self._STATES])
+
+    def _reward(self) -> np.ndarray:
+        with self._timings('reward'):
+            return np.array([reward.calculate() for reward in self._REWARDS], dtype=np.float64)
+
+    def _done(self) -> bool:
+        return False
+
+    def _environment_step(self, duration:int):
+        """ advances SUMO simulation by given number of seconds in a single call """
+        with self._timings('simulation'):
+            self._time += duration
+            self._sim.simulationStep(float(self._time))  # traci warns about int targets from 1000 s on
+
+    def junctions(self) -> List[str]:
+        return list(self._junctions)
+
+    def num_actions(self) -> int:
+        return len(self._green_states[0])
+
+    def state_size(self) -> int:
+        return self._STATES[0].size()
+
+    def observer(self) -> LaneObserver:
+        """ shared lane observation cache, metrics should be built on top of it """
+        return self._observer
+
+    def timings(self) -> Timings:
+        """ cumulative wall time of environment sections, see Environment_Traffic_Lights.timings """
+        return self._timings
+
     def hiperparams(self) -> dict:
         return self._hp
 
@@ -0,0 +1,108 @@
+import copy
+import contextlib
+import torch
+import torch.nn as nn
+from typing import Tuple, Union
+
+from memory import ReplayBuffer, MemoryPalace
+from profiling import Timings
+
+
+class DQNTrainer:
+    """
+    one code path for (double) deep Q-learning updates with a replay buffer
+        - Qtarget given: expected values come from the target network (DDQL)
+        - Qtarget None: Qnet evaluates next states itself, both batches then go through a single forward pass
+        - MemoryPalace buffer: losses are importance-sampling weighted and priorities updated with td errors
+    """
+
+    def __init__(self, Qnet: nn.Module, Qtarget: Union[None, nn.Module], optimizer: torch.optim.Optimizer,
+                 replay_buffer: ReplayBuffer, loss: nn.Module = None, batch_size: int = 32, gamma: float = 0.99,
+                 gradient_steps: int = 1, compile: bool = False, device: str = 'cpu', sample_lock = None):
+        self.Qnet = Qnet
+        self.Qtarget = Qtarget
+        self.optimizer = optimizer
+        self.replay_buffer = replay_buffer
+
+        self._loss = nn.HuberLoss() if loss is None else loss
+        self._elementwise_loss = copy.copy(self._loss)
+        self._elementwise_loss.reduction = 'none'
+
+        self._batch_size = batch_size
+        self._gamma = gamma
+        self._gradient_steps = gradient_steps
+        self._prioritized = isinstance(replay_buffer, MemoryPalace)
+        # held while sampling and updating priorities, when another thread appends to the buffer
+        self._sample_lock = contextlib.nullcontext() if sample_lock is None else sample_lock
+
+        # reused for indexing chosen actions' q values instead of a fresh np.arange every update
+        self._batch_index = torch.arange(batch_size, device=device)
+
+        # wall time of replay sampling, optimizer steps (forward, backward, step) and priority updates
+        self._timings = Timings()
+
+        self._compute_loss = self._loss_and_td_errors
+        if compile and hasattr(torch, 'compile'):
+            self._compute_loss = torch.compile(self._loss_and_td_errors)
+
+    def update(self, gradient_steps: Union[None, int] = None) -> float:
+        """ performs gradient_steps updates on sampled batches, returns their mean loss """
+        gradient_steps = self._gradient_steps if gradient_steps is None else gradient_steps
+
+        total_loss = 0.
+        for _ in range(gradient_steps):
+            with self._timings('sampling'), self._sample_lock:
+                batch = self.replay_buffer.sample(size=self._batch_size)
+            if self._prioritized:
+                states, actions, rewards, next_states, dones, weights, indicies = batch
+            else:
+                (states, actions, rewards, next_states, dones), weights = batch, None
+
+            with self._timings('optimization'):
+                _loss, _td_errors = self._compute_loss(states, actions, rewards, next_states, dones, weights)
+
+                self.optimizer.zero_grad(set_to_none=True)
+                _loss.backward()
+                self.optimizer.step()
+                total_loss += _loss.item()
+
+            if self._prioritized:
+                with self._timings('priorities'), self._sample_lock:
+                    self.replay_buffer.update_priorities(indicies, _td_errors)
+
+        return total_loss / gradient_steps
+
+    def timings(self) -> Timings:
+        """ cumulative wall time of sampling, optimization and priorities sections """
+        return self._timings
+
+    def sync_target(self):
+        """ copies Qnet weights into the target network """
+        if self.Qtarget is not None:
+            self.Qtarget.load_state_dict(self.Qnet.state_dict())
+
+    def _loss_and_td_errors(self, states: torch.Tensor, actions: torch.Tensor, rewards: torch.Tensor,
+                            next_states: torch.Tensor, dones: torch.Tensor,
+                            weights: Union[None, torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor]:
+        batch_size = actions.shape[0]
+
+        if self.Qtarget is None:
+            _qvalues = self.Qnet(torch.cat((states, next_states)))
+            _qvalues_all, _qvalues_next_all = _qvalues[:batch_size], _qvalues[batch_size:].detach()
+        else:
+            _qvalues_all = self.Qnet(states)
+            with torch.no_grad():
+                _qvalues_next_all = self.Qtarget(next_states)
+
+        _qvalues_actions = _qvalues_all[self._batch_index[:batch_size], actions]
+
+        with torch.no_grad():
+            _qvalues_next_max = _qvalues_next_all.max(dim=1)[0].masked_fill(dones, 0)
+            _qvalues_expected = rewards + self._gamma * _qvalues_next_max
+
+        if weights is None:
+            _loss = self._loss(_qvalues_expected, _qvalues_actions)
+        else:
+            _loss = (weights * self._elementwise_loss(_qvalues_expected, _qvalues_actions)).mean()
+
+        return _loss, (_qvalues_expected - _qvalues_actions).detach()
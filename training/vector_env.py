@@ -0,0 +1,106 @@
+import numpy as np
+import multiprocessing as mp
+import importlib
+from pathlib import Path
+from typing import List, Tuple, Union
+
+envs = importlib.import_module('traffic_envs')
+
+
+def worker_route_file(route_file: str, worker_id: int) -> str:
+    """ per-worker copy of the route file name, e.g. intersection/my_net.w3.rou.xml """
+    path = Path(route_file)
+    stem, _, suffix = path.name.partition('.')
+    return str(path.with_name(f'{stem}.w{worker_id}.{suffix}'))
+
+
+def _worker(remote, parent_remote, env_class_name: str, env_kwargs: dict, seed: Union[None, int]):
+    """ owns one environment (and its SUMO instance) and serves commands sent through the pipe """
+    parent_remote.close()
+    np.random.seed(seed)
+    env = getattr(envs, env_class_name)(**env_kwargs)
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                state, reward, done, info = env.step(data)
+                if done:
+                    info['terminal_state'] = state
+                    state = env.reset()
+                remote.send((state, reward, done, info))
+            elif cmd == 'reset':
+                remote.send(env.reset())
+            elif cmd == 'hiperparams':
+                remote.send(env.hiperparams())
+            elif cmd == 'close':
+                break
+    finally:
+        env.close()
+        remote.close()
+
+
+class VectorEnv:
+    """
+    runs num_envs environments in separate worker processes, one SUMO instance each
+        - reset() -> stacked states, shape (num_envs, state_size)
+        - step(actions) -> stacked states, rewards, dones and a list of info dicts
+    finished sub-environments are reset automatically, their last state is kept in info['terminal_state']
+    """
+
+    def __init__(self, num_envs: int, env_class: str = 'Environment_Traffic_Lights', seed: Union[None, int] = None,
+                 route_file: str = 'intersection/my_net.rou.xml', **env_kwargs):
+        self.num_envs = num_envs
+
+        ctx = mp.get_context('spawn')
+        self._remotes, work_remotes = zip(*[ctx.Pipe() for _ in range(num_envs)])
+        self._processes = []
+        for i, (remote, work_remote) in enumerate(zip(self._remotes, work_remotes)):
+            kwargs = {**env_kwargs, 'route_file': worker_route_file(route_file, i)}
+            worker_seed = None if seed is None else seed + i
+            process = ctx.Process(target=_worker, args=(work_remote, remote, env_class, kwargs, worker_seed), daemon=True)
+            process.start()
+            self._processes.append(process)
+            work_remote.close()
+
+        self._closed = False
+
+    def reset(self) -> np.ndarray:
+        for remote in self._remotes:
+            remote.send(('reset', None))
+        return np.stack([remote.recv() for remote in self._remotes])
+
+    def step(self, actions: Union[List[int], np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[dict]]:
+        for remote, action in zip(self._remotes, actions):
+            remote.send(('step', int(action)))
+        states, rewards, dones, infos = zip(*[remote.recv() for remote in self._remotes])
+        return np.stack(states), np.array(rewards), np.array(dones, dtype=bool), list(infos)
+
+    def hiperparams(self) -> List[dict]:
+        for remote in self._remotes:
+            remote.send(('hiperparams', None))
+        return [remote.recv() for remote in self._remotes]
+
+    def close(self):
+        if self._closed:
+            return
+        for remote in self._remotes:
+            remote.send(('close', None))
+        for process in self._processes:
+            process.join()
+        self._closed = True
+
+    def __len__(self) -> int:
+        return self.num_envs
+
+
+if __name__ == '__main__':
+    from states import QueueState
+    from rewards import NegQueueReward
+
+    venv = VectorEnv(4, state_class=QueueState, reward_class=NegQueueReward, max_steps=100,
+                     route_car_freq=[0.02, 0.05, 0.01]*4, seed=0)
+    s = venv.reset()
+    for t in range(100):
+        s, r, d, _ = venv.step(np.random.randint(4, size=len(venv)))
+    print(s.shape, r)
+    venv.close()